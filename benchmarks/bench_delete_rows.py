@@ -0,0 +1,77 @@
+"""
+Benchmark: per-row delete_rows loop vs. range-coalesced deleteDimension batch.
+
+Each simulated API call costs a fixed latency (default 50 ms; real Sheets round trips are usually slower),
+so the wall time is dominated by the number of calls, just like against the real API. The quota buckets
+are switched off, so that the batch path is timed rather than QuotaManager's throttling.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_delete_rows [latency_in_seconds]
+"""
+import random
+import sys
+import time
+
+from utils.quota_manager import QuotaManager
+from utils.sheet_manager import SheetManager
+
+
+class FakeWorksheet:
+    id = 0
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls   = 0
+
+    def delete_rows(self, index):
+        self.calls += 1
+        time.sleep(self.latency)
+
+
+class FakeSpreadsheet:
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls   = 0
+
+    def batch_update(self, body):
+        self.calls += 1
+        time.sleep(self.latency)
+
+
+def legacy_delete(worksheet, row_idxs):
+    for idx in sorted(row_idxs, reverse = True):
+        worksheet.delete_rows(idx + 2)
+
+
+def run(n, pattern, latency):
+    if pattern == "contiguous":
+        row_idxs = list(range(1000, 1000 + n))
+    elif pattern == "interleaved":
+        row_idxs = list(range(0, 2 * n, 2))
+    else:
+        row_idxs = random.Random(n).sample(range(10 * n), n)
+
+    ws = FakeWorksheet(latency)
+    start = time.perf_counter()
+    legacy_delete(ws, row_idxs)
+    legacy_time = time.perf_counter() - start
+
+    sheet, ws = FakeSpreadsheet(latency), FakeWorksheet(latency)
+    start = time.perf_counter()
+    ranges = SheetManager.coalesce_ranges(row_idxs)
+    SheetManager.delete_ranges(sheet, ws, ranges)
+    batched_time = time.perf_counter() - start
+
+    return len(ranges), n, legacy_time, sheet.calls, batched_time
+
+
+if __name__ == "__main__":
+    QuotaManager.enabled = False
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+    print(f"simulated latency per call: {latency * 1000:.0f} ms")
+    print(f"{'rows':>6} {'pattern':>12} {'ranges':>7} {'legacy calls':>13} {'legacy s':>9} {'batch calls':>12} {'batch s':>8}")
+    for n in [1, 10, 100, 300]:
+        for pattern in ["contiguous", "interleaved", "random"]:
+            ranges, legacy_calls, legacy_time, batch_calls, batch_time = run(n, pattern, latency)
+            print(f"{n:>6} {pattern:>12} {ranges:>7} {legacy_calls:>13} {legacy_time:>9.2f} {batch_calls:>12} {batch_time:>8.2f}")
@@ -0,0 +1,93 @@
+"""
+Benchmark: per-document mask + iterrows parsing of chat histories vs. BootstrapManager.build_messages.
+
+The legacy path is the block the pages used to run after every load: for each document, filter the
+whole user_chats frame twice with a boolean mask and iterrows() the match, i.e. O(docs x chats).
+build_messages reads each column once and groups the rows in one pass, i.e. O(docs + chats); the scaling table
+grows docs and chats together, so linear time doubles per step and the legacy time roughly quadruples.
+Pages now use LazyMessages, which only builds the documents that are opened; the last line times opening one.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_messages [n_docs] [n_chats]
+"""
+import random
+import sys
+import time
+
+import pandas as pd
+
+from utils.blob_manager import BlobManager
+from utils.bootstrap_manager import BootstrapManager, LazyMessages
+
+
+def synthetic_tables(n_docs, n_chats, seed = 0):
+    rng = random.Random(seed)
+    doc_ids = [f"user000001-{i:08d}" for i in range(n_docs)]
+    user_docs = pd.DataFrame({"_fileId": doc_ids, "_fileName": [f"paper_{i}.pdf" for i in range(n_docs)]})
+    user_chats = pd.DataFrame({
+        "_fileId": [rng.choice(doc_ids) for _ in range(n_chats)],
+        "_role": ["user" if i % 2 == 0 else "assistant" for i in range(n_chats)],
+        "_content": [f"message {i} " * 20 for i in range(n_chats)],
+        "_model": ["-" if i % 2 == 0 else "gpt-4o-mini" for i in range(n_chats)],
+        "_time": ["01/01/2025, 10:00:00"] * n_chats
+    })
+    return user_docs, user_chats
+
+
+def legacy_messages(user_docs, user_chats):
+    messages = {}
+    for _, row in user_docs.iterrows():
+        doc_id = row["_fileId"]
+        doc_name = row["_fileName"]
+        messages.update({
+            doc_id: {
+                "doc_name": doc_name,
+                "chat_history": [
+                    {
+                        "role": row["_role"],
+                        "content": BlobManager.resolve(row["_content"]),
+                        "model": row["_model"],
+                        "time": row["_time"]
+                    }
+                    for _, row in user_chats[user_chats["_fileId"] == doc_id].iterrows()
+                ] if not user_chats[user_chats["_fileId"] == doc_id].empty
+                else []
+            }
+        })
+    return messages
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    n_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000
+    n_chats = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+
+    user_docs, user_chats = synthetic_tables(n_docs, n_chats)
+    legacy, legacy_time = timed(legacy_messages, user_docs, user_chats)
+    grouped, grouped_time = timed(BootstrapManager.build_messages, user_docs, user_chats)
+    assert legacy == grouped
+
+    doc_names = dict(zip(user_docs["_fileId"], user_docs["_fileName"]))
+    lazy = LazyMessages(doc_names, user_chats = user_chats)
+    doc_id = user_docs["_fileId"].iloc[n_docs // 2]
+    _, lazy_time = timed(lazy.__getitem__, doc_id)
+    assert lazy[doc_id] == grouped[doc_id] and lazy.built == 1
+    assert dict(LazyMessages(doc_names, user_chats = user_chats).items()) == grouped
+
+    print(f"docs: {n_docs}, chat rows: {n_chats}")
+    print(f"legacy mask + iterrows : {legacy_time * 1000:9.1f} ms")
+    print(f"build_messages         : {grouped_time * 1000:9.1f} ms")
+    print(f"LazyMessages, 1 doc    : {lazy_time * 1000:9.1f} ms")
+
+    print("\nscaling (docs and chats grow together):")
+    print(f"{'docs':>6} {'chats':>7} {'legacy ms':>10} {'grouped ms':>11}")
+    for fraction in [0.125, 0.25, 0.5, 1.0]:
+        docs, chats = synthetic_tables(int(n_docs * fraction), int(n_chats * fraction))
+        _, legacy_time = timed(legacy_messages, docs, chats)
+        _, grouped_time = timed(BootstrapManager.build_messages, docs, chats)
+        print(f"{len(docs):>6} {len(chats):>7} {legacy_time * 1000:>10.1f} {grouped_time * 1000:>11.1f}")
@@ -0,0 +1,75 @@
+"""
+Benchmark: login lookups by column scans on the user_info frame vs. UserDirectory hash indexes.
+
+The legacy path is what UserManager.log_in used to do per login: membership checks on `.tolist()`
+of two columns plus `.loc[...]` scans for each field of the record. The directory pays a one-off
+indexing cost (and a cheap tail index after new registrations), then answers with a dict lookup.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_user_directory [n_users] [n_logins]
+"""
+import random
+import sys
+import time
+
+import pandas as pd
+
+from utils.user_manager import UserDirectory
+
+
+def synthetic_users(n):
+    return pd.DataFrame({
+        "_username": [f"user {i}" for i in range(n)],
+        "_userId": [f"user{i:06d}" for i in range(n)],
+        "_email": [f"user{i:06d}@gmail.com" for i in range(n)],
+        "_password": [f"{i:064x}" for i in range(n)],
+        "_registerTime": ["10:00AM on January 01, 2025"] * n,
+        "_dbURL": [f"https://docs.google.com/spreadsheets/d/{i:044d}/edit" for i in range(n)]
+    })
+
+
+def legacy_login(user_infos, user_id):
+    if ((user_id not in user_infos['_userId'].tolist()) and
+        (user_id not in user_infos['_email'].tolist())):
+        return None
+    column = "_email" if user_id.endswith("@gmail.com") else "_userId"
+    record = {field: user_infos.loc[user_infos[column] == user_id, field].tolist()[0]
+              for field in ["_password", "_username", "_userId", "_dbURL", "_email", "_registerTime"]}
+    return record
+
+
+def directory_login(user_id):
+    return UserDirectory.lookup("_userId", user_id) or UserDirectory.lookup("_email", user_id)
+
+
+if __name__ == "__main__":
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_logins = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    users = synthetic_users(n_users)
+    rng = random.Random(0)
+    keys = [f"user{rng.randrange(n_users):06d}" + ("@gmail.com" if i % 2 else "") for i in range(n_logins)]
+
+    start = time.perf_counter()
+    for key in keys:
+        assert legacy_login(users, key) is not None
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    UserDirectory.load(users)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for key in keys:
+        assert directory_login(key) is not None
+    lookup_time = time.perf_counter() - start
+
+    grown = pd.concat([users, synthetic_users(n_users + 100).iloc[n_users:]], ignore_index = True)
+    start = time.perf_counter()
+    added = UserDirectory.load(grown)
+    tail_time = time.perf_counter() - start
+
+    print(f"users: {n_users}, logins: {n_logins}")
+    print(f"legacy scans      : {legacy_time / n_logins * 1000:9.3f} ms / login")
+    print(f"directory build   : {build_time * 1000:9.1f} ms (once per process)")
+    print(f"directory lookup  : {lookup_time / n_logins * 1e6:9.3f} us / login")
+    print(f"tail index ({added} new users): {tail_time * 1000:.2f} ms")
@@ -5,6 +5,8 @@ import time
 from utils.data_manager import DataManager
 from utils.prompt_manager import PromptManager
 from utils.sheet_manager import SheetManager
+from utils.queue_manager import QueueManager
+from utils.bootstrap_manager import BootstrapManager
 from utils.user_manager import UserManager
 from utils.docs_manager import PineconeManager
 from utils.others import Others
@@ -84,11 +86,13 @@ def main():
 
     # * Button for logging out
     if st.button("Log Out", "logout", icon = ":material/logout:", width = "stretch"):
+        with st.spinner("Saving chat histories..."):
+            QueueManager.flush(st.session_state["sheet_id"])
         st.session_state['logged_in'] = False
         st.success("Logged Out")
         for session in ["user_email", "user_id", "_registerTime", "messages", "user_docs", "user_tags", "user_chats",
                         "sheet_id", "_dbURL"]:
-            del st.session_state[session]
+            st.session_state.pop(session, None)     # * user_chats is only present if it was loaded
         time.sleep(2)
         st.rerun()
 
@@ -120,41 +124,6 @@ else:
         st.warning("This account does not have database configured. Click the following button to set up your database!")
         st.stop()
 
-    if "sheet_id" not in st.session_state:
-        st.session_state["sheet_id"] = SheetManager.extract_sheet_id(st.session_state["_dbURL"])  # * initialized in user_manager!
-
-    if "user_docs" not in st.session_state:
-        with st.spinner("loading literature..."):
-            st.session_state['user_docs'] = SheetManager.fetch(st.session_state["sheet_id"], "user_docs")
-
-    if "user_tags" not in st.session_state:
-        with st.spinner("loading tags..."):
-            st.session_state["user_tags"] = SheetManager.fetch(st.session_state["sheet_id"], "user_tags") 
-
-    if "user_chats" not in st.session_state:
-        with st.spinner("loading chat histories..."):
-            st.session_state["user_chats"] = SheetManager.fetch(st.session_state["sheet_id"], "user_chats") 
-
-    if "messages" not in st.session_state:
-        with st.spinner("parsing chat histories..."):
-            st.session_state["messages"] = {}
-            for _, row in st.session_state['user_docs'].iterrows():
-                doc_id = row["_fileId"]
-                doc_name = row["_fileName"]
-                st.session_state["messages"].update({
-                    doc_id: {
-                        "doc_name": doc_name,
-                        "chat_history": [
-                            {
-                                "role": row["_role"],
-                                "content": row["_content"],
-                                "model": row["_model"],
-                                "time": row["_time"]
-                            }
-                            for _, row in st.session_state['user_chats'][st.session_state['user_chats']["_fileId"] == doc_id].iterrows()
-                        ] if not st.session_state['user_chats'][st.session_state['user_chats']["_fileId"] == doc_id].empty
-                        else []
-                    }
-                })
+    BootstrapManager.run()     # * sheet_id, user_docs / user_tags and the chat histories (built when first read)
 
     main()
\ No newline at end of file
@@ -5,9 +5,12 @@ import time
 from datetime import datetime
 import io
 from utils.data_manager import DataManager
+from utils.blob_manager import BlobManager
 from utils.llm_manager import ChatBot
 from utils.prompt_manager import PromptManager
 from utils.sheet_manager import SheetManager
+from utils.queue_manager import QueueManager
+from utils.bootstrap_manager import BootstrapManager
 from utils.user_manager import UserManager
 from utils.docs_manager import PineconeManager
 from utils.others import Others
@@ -55,6 +58,9 @@ if "characters" not in st.session_state:
         "system": ":material/brightness_alert:"
     }
 
+if "chat_window" not in st.session_state:
+    st.session_state["chat_window"] = {}     # * doc_id -> number of the latest messages shown
+
 if "chat_params" not in st.session_state:
     st.session_state["chat_params"] = {
         "RAG_strictness": "high",
@@ -97,7 +103,7 @@ def ConfigLiterature():
 
     if selected_file:
         doc_id = st.session_state['user_docs'].loc[st.session_state['user_docs']['_fileName'] == selected_file, '_fileId'].tolist()[0]
-        summary = st.session_state['user_docs'].loc[st.session_state['user_docs']['_fileName'] == selected_file, '_summary'].tolist()[0]
+        summary = DataManager.get_summary(doc_id)
 
         st.session_state['chat_params']["doc_id"] = doc_id
         st.session_state['chat_params']["summary"] = summary
@@ -163,29 +169,37 @@ Chat histories will be saved in excel format.
             width = "stretch"
         )
 
+# * - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
+# *** Settings panel, as a fragment: its widgets only rerun the panel, not the page
+@st.fragment
+def Settings():
+    # * Selection box for selecting documents to chat with
+    with st.container(border = True, height = 310):
+        st.subheader(":material/settings: Settings")
+
+        TAB_DOCS, TAB_MODEL, TAB_CHAT = st.tabs(["Literature", "Model", "Chat"])
+
+        with TAB_DOCS:
+            ConfigLiterature()
+        with TAB_MODEL:
+            ConfigLLM()
+        with TAB_CHAT:
+            ConfigChat()
+
+    # * Another paper was selected: the chat pane has to show it. The pane's paper is recorded first, so the
+    # * app run this triggers (or any later full run) does not see the mismatch again
+    if st.session_state.get("chat_pane_doc", st.session_state['chat_params']["doc_id"]) != st.session_state['chat_params']["doc_id"]:
+        st.session_state["chat_pane_doc"] = st.session_state['chat_params']["doc_id"]
+        st.rerun(scope = "app")
+
 def main():
 
     with st.sidebar:
-        # * Selection box for selecting documents to chat with
-        with st.container(border = True, height = 310):
-            st.subheader(":material/settings: Settings")
-
-            TAB_DOCS, TAB_MODEL, TAB_CHAT = st.tabs(["Literature", "Model", "Chat"])
+        Settings()
 
-            with TAB_DOCS:
-                ConfigLiterature()
-            with TAB_MODEL:
-                ConfigLLM()
-            with TAB_CHAT:
-                ConfigChat()
-
-            
         if st.button("Refresh", "reload", icon = ":material/refresh:", width = "stretch"):
             del st.session_state["pdfs_raw"]
-            del st.session_state["user_docs"]
-            del st.session_state["user_tags"]
-            del st.session_state["user_chats"]
-            del st.session_state["messages"]
+            BootstrapManager.refresh()     # * only reloads if the database changed
             st.rerun()
 
         
@@ -194,9 +208,16 @@ def main():
         st.caption(f"Logged in as: **{st.session_state['user_id']}**")
 
     st.title("Chat with Literature")
+    ChatPane()
+
+# * - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
+# *** Summary, transcript and chat input, as a fragment: sending a message only reruns this pane
+@st.fragment
+def ChatPane():
+    st.session_state["chat_pane_doc"] = st.session_state['chat_params']["doc_id"]
     if not st.session_state['chat_params']["doc_id"]:
             st.warning("There is no literature under the selected tag. Please upload the literature in **Upload & Summarize Literature** page under the tag, or choose other tags.")
-            st.stop()
+            return
 
 
     with st.expander(":material/dashboard: Literature Summary"):
@@ -209,9 +230,15 @@ def main():
         with st.chat_message("assistant", avatar = st.session_state["characters"]["assistant"]):
             st.markdown("**:blue[Ask me something about the paper!]**")
     else:
-        for i, message in enumerate(
-            st.session_state.messages[st.session_state['chat_params']['doc_id']]['chat_history']
-            ):
+        # * Only the latest messages are rendered; "Load earlier" pages backwards
+        chat_history = st.session_state.messages[st.session_state['chat_params']['doc_id']]['chat_history']
+        shown = st.session_state["chat_window"].get(st.session_state['chat_params']['doc_id'], Consts.chat_window)
+        hidden = max(len(chat_history) - shown, 0)
+        if hidden:
+            if st.button(f"Load earlier messages ({hidden} more)", "load_earlier", icon = ":material/expand_less:", width = "stretch"):
+                st.session_state["chat_window"][st.session_state['chat_params']['doc_id']] = shown + Consts.chat_window
+                st.rerun(scope = "fragment")
+        for message in chat_history[hidden:]:
             with st.chat_message(message["role"], avatar = st.session_state["characters"][message["role"]]):
                 st.markdown(message["content"])
 
@@ -233,11 +260,11 @@ def main():
                   "content": in_message, 
                   "time": user_input_time,
                   "model": st.session_state["ChatBot"].model_key}))
-        # Add user message to chat database (google sheet)
-        SheetManager.insert(
+        # Add user message to chat database (google sheet, written in background)
+        QueueManager.enqueue(
             sheet_id  = st.session_state["sheet_id"],
             worksheet = "user_chats",
-            row       = [st.session_state["chat_params"]["doc_id"], "user", in_message, "-", user_input_time]
+            row       = [st.session_state["chat_params"]["doc_id"], "user", BlobManager.pack(in_message), "-", user_input_time]
         )
 
         # *** --- Query from Pinecone Embedding DB
@@ -282,13 +309,13 @@ def main():
                          "time": assistant_answer_time,
                          "model": st.session_state["ChatBot"].model_key}))
                 
-            # Add assistant message to chat database (google sheet)
-            SheetManager.insert(
+            # Add assistant message to chat database (google sheet, written in background)
+            QueueManager.enqueue(
                 sheet_id   = st.session_state["sheet_id"],
                 worksheet  = "user_chats",
                 row        = [st.session_state["chat_params"]["doc_id"], 
                                 "assistant", 
-                                response, 
+                                BlobManager.pack(response), 
                                 st.session_state["ChatBot"].model_key, 
                                 assistant_answer_time]
                         )
@@ -324,41 +351,6 @@ else:
         st.warning("This account does not have database configured. Click the following button to set up your database!")
         st.stop()
 
-    if "sheet_id" not in st.session_state:
-        st.session_state["sheet_id"] = SheetManager.extract_sheet_id(st.session_state["_dbURL"])  # * initialized in user_manager!
-
-    if "user_docs" not in st.session_state:
-        with st.spinner("loading literature..."):
-            st.session_state['user_docs'] = SheetManager.fetch(st.session_state["sheet_id"], "user_docs")
-
-    if "user_tags" not in st.session_state:
-        with st.spinner("loading tags..."):
-            st.session_state["user_tags"] = SheetManager.fetch(st.session_state["sheet_id"], "user_tags") 
-
-    if "user_chats" not in st.session_state:
-        with st.spinner("loading chat histories..."):
-            st.session_state["user_chats"] = SheetManager.fetch(st.session_state["sheet_id"], "user_chats") 
-
-    if "messages" not in st.session_state:
-        with st.spinner("parsing chat histories..."):
-            st.session_state["messages"] = {}
-            for _, row in st.session_state['user_docs'].iterrows():
-                doc_id = row["_fileId"]
-                doc_name = row["_fileName"]
-                st.session_state["messages"].update({
-                    doc_id: {
-                        "doc_name": doc_name,
-                        "chat_history": [
-                            {
-                                "role": row["_role"],
-                                "content": row["_content"],
-                                "model": row["_model"],
-                                "time": row["_time"]
-                            }
-                            for _, row in st.session_state['user_chats'][st.session_state['user_chats']["_fileId"] == doc_id].iterrows()
-                        ] if not st.session_state['user_chats'][st.session_state['user_chats']["_fileId"] == doc_id].empty
-                        else []
-                    }
-                })
+    BootstrapManager.run()     # * sheet_id, user_docs / user_tags and the chat histories (built when first read)
 
     main()
\ No newline at end of file
@@ -5,6 +5,11 @@ from utils.data_manager import DataManager
 from utils.llm_manager import Summarizor
 from utils.prompt_manager import PromptManager
 from utils.sheet_manager import SheetManager
+from utils.storage_manager import StorageManager
+from utils.queue_manager import QueueManager
+from utils.index_manager import IndexManager
+from utils.bootstrap_manager import BootstrapManager
+from utils.session_manager import SessionManager
 from utils.user_manager import UserManager
 from utils.docs_manager import PineconeManager
 from utils.others import Others
@@ -69,10 +74,7 @@ def main():
     # * Render user name and refresh button after logged in
     with st.sidebar:
         if st.button("Refresh", key = "reload", icon = ":material/refresh:", width = "stretch"):
-            del st.session_state["user_docs"]
-            del st.session_state["user_tags"]
-            del st.session_state["user_chats"]
-            del st.session_state["messages"]
+            BootstrapManager.refresh()     # * only reloads if the database changed
             st.rerun()
     
         st.caption(f"Logged in as: **{st.session_state['user_id']}**")
@@ -92,7 +94,8 @@ def main():
         
         with st.spinner("loading"):
             try:
-                res = st.session_state['user_docs'].loc[st.session_state['user_docs']['_fileName'] == selected_file, '_summary'].tolist()[0]
+                doc_id = st.session_state['user_docs'].loc[st.session_state['user_docs']['_fileName'] == selected_file, '_fileId'].tolist()[0]
+                res = DataManager.get_summary(doc_id)
                 st.markdown(res, unsafe_allow_html = True, help = "hah")
             except:
                 st.warning("""There is no literature under the selected tag.
@@ -170,32 +173,44 @@ Please upload a new literature at **Upload & Summarize Literature** page.""")
             if "delete" in st.session_state:
                 with st.spinner("Deleting..."):
 
-                    # * Filter the indices of docs to delete
+                    # * Docs to delete (rows are located by _fileId at write time)
                     docs_to_delete = st.session_state["user_docs"][[ True if id in edit_files[edit_files['_selected']]['_fileId'].tolist() else False for id in st.session_state["user_docs"]["_fileId"]]]
-                    chat_to_delete = st.session_state["user_chats"][[ True if id in edit_files[edit_files['_selected']]['_fileId'].tolist() else False for id in st.session_state["user_chats"]["_fileId"]]]
                     
 
                     # * Delete literature from google sheet
                     with st.spinner("Deleting literature summary and metadata..."):
-                        SheetManager.acquire_lock(st.session_state["sheet_id"], "user_docs")
-                        st.session_state["user_docs"] = SheetManager.fetch(st.session_state["sheet_id"], "user_docs")
-                        SheetManager.delete_row(
+                        if StorageManager.backend().acquire_lock(st.session_state["sheet_id"], "user_docs") == False:
+                            st.warning("Try again")
+                            del st.session_state["delete"]
+                            time.sleep(1.5)
+                            st.rerun()
+                        deleted = IndexManager.delete_by_key(
                             sheet_id = st.session_state["sheet_id"],
-                            worksheet_name = "user_docs",
-                            row_idxs = docs_to_delete.index
+                            worksheet = "user_docs",
+                            key_column = "_fileId",
+                            keys = docs_to_delete["_fileId"].tolist()
                         )
-                        SheetManager.release_lock(st.session_state["sheet_id"], "user_docs")
+                        StorageManager.backend().release_lock(st.session_state["sheet_id"], "user_docs")
+                        if not deleted:
+                            del st.session_state["delete"]
+                            st.stop()
 
                     # * Delete chat history
                     with st.spinner("Deleting relevant chat history..."):
-                        SheetManager.acquire_lock(st.session_state["sheet_id"], "user_chats")
-                        st.session_state["user_chats"] = SheetManager.fetch(st.session_state["sheet_id"], "user_chats")
-                        SheetManager.delete_row(
+                        # * chat rows still queued would be appended after the drop and bring the partitions back
+                        if not QueueManager.flush(st.session_state["sheet_id"]):
+                            st.warning("Some chat messages are still being saved. Please try again later.")
+                            del st.session_state["delete"]
+                            st.stop()
+                        # * each document's chats are a partition of their own, dropped in one request
+                        deleted = StorageManager.backend().delete_partitions(
                             sheet_id = st.session_state["sheet_id"],
-                            worksheet_name = "user_chats",
-                            row_idxs = chat_to_delete.index
+                            table = "user_chats",
+                            keys = docs_to_delete["_fileId"].tolist()
                         )
-                        SheetManager.release_lock(st.session_state["sheet_id"], "user_chats")
+                        if not deleted:
+                            del st.session_state["delete"]
+                            st.stop()
 
                     # * Delete relevant source data from Pinecone
                     for _, row in docs_to_delete.iterrows():
@@ -204,10 +219,10 @@ Please upload a new literature at **Upload & Summarize Literature** page.""")
                                                doc_title  = row["_fileName"],
                                                index_name = st.session_state["pinecone_idx_name"]))
 
-                # * Reset session state
+                # * Patch the session's tables
                 st.success("Deleted all selected data!")
                 time.sleep(1)
-                del st.session_state['user_docs']
+                SessionManager.docs_deleted(docs_to_delete["_fileId"].tolist())
                 del st.session_state["delete"]
                 st.rerun()
 
@@ -225,25 +240,28 @@ Please upload a new literature at **Upload & Summarize Literature** page.""")
                     st.rerun()
                 with st.spinner("Updating..."):
                     # * Acqcuire lock for the user first, before deletion
-                    SheetManager.acquire_lock(st.session_state["sheet_id"], "user_docs")
+                    if StorageManager.backend().acquire_lock(st.session_state["sheet_id"], "user_docs") == False:
+                        st.warning("Try again")
+                        time.sleep(1.5)
+                        st.rerun()
                     
-                    # * Reload the user_docs data before deletion, after lock
-                    st.session_state["user_docs"] = SheetManager.fetch(st.session_state["sheet_id"], "user_docs")
-
-                    # * Update
-                    SheetManager.update(st.session_state["sheet_id"],
-                                        "user_docs",
-                                        st.session_state["user_docs"][st.session_state["user_docs"]['_fileId'].isin(update_dict.keys())].index,
-                                        "_tag",
-                                        [update_dict[i] for i in st.session_state["user_docs"][st.session_state["user_docs"]['_fileId'].isin(update_dict.keys())]['_fileId'].tolist()]
-                                        )
+                    # * Update by _fileId (single batched request; rows are located through the key index)
+                    results = IndexManager.update_by_key(st.session_state["sheet_id"],
+                                                         "user_docs",
+                                                         "_fileId",
+                                                         {file_id: {"_tag": tag} for file_id, tag in update_dict.items()})
+                    if len(results) != len(update_dict):
+                        st.warning("Some tags were not saved. Please refresh and try again.")
                 
                     # * Release the lock
-                    SheetManager.release_lock(st.session_state["sheet_id"], "user_docs")
+                    StorageManager.backend().release_lock(st.session_state["sheet_id"], "user_docs")
 
-                # * Reset session state
+                # * Patch the session's tables (reload user_docs if some rows were not written)
                 st.success("Updated!")
-                del st.session_state['user_docs']
+                if len(results) == len(update_dict):
+                    SessionManager.docs_retagged(update_dict)
+                else:
+                    SessionManager.invalidate("user_docs")
                 time.sleep(1.5)
                 st.rerun()
 
@@ -262,20 +280,22 @@ Please upload a new literature at **Upload & Summarize Literature** page.""")
                     else:
                         with st.spinner("Adding"):
                             # * acquire lock
-                            if SheetManager.acquire_lock(st.session_state['sheet_id'], "user_tags") == False:
+                            if StorageManager.backend().acquire_lock(st.session_state['sheet_id'], "user_tags") == False:
                                 st.warning("Try again")
                                 time.sleep(1.5)
                                 st.rerun()
                             
                             # * conduct insertion
-                            SheetManager.insert(
-                                st.session_state['sheet_id'], 
-                                "user_tags", 
-                                [DataManager.generate_random_index(), tag_to_add])
+                            tag_id = DataManager.generate_random_index()
+                            try:
+                                StorageManager.backend().insert_rows(st.session_state['sheet_id'], "user_tags", [[tag_id, tag_to_add]])
+                                SessionManager.tag_added(tag_id, tag_to_add)
+                            except Exception as e:
+                                st.error(f"Failed to save to the database: {e}")
+                                SessionManager.invalidate("user_tags")
                             
                             # * release lock
-                            SheetManager.release_lock(st.session_state['sheet_id'], "user_tags")
-                            del st.session_state["user_tags"]
+                            StorageManager.backend().release_lock(st.session_state['sheet_id'], "user_tags")
                             st.rerun()
                 else:
                     st.warning("Please input the name of tag that you want to add")
@@ -294,41 +314,40 @@ Please upload a new literature at **Upload & Summarize Literature** page.""")
                 with st.spinner("Deleting"):
 
                     # * Acqcuire lock for the user first, before deletion
-                    if SheetManager.acquire_lock(st.session_state["sheet_id"], "user_tags") == False:
+                    if StorageManager.backend().acquire_lock(st.session_state["sheet_id"], "user_tags") == False:
                         st.warning("Try again")
                         time.sleep(1)
                         st.rerun()
 
-                    # * Reload tag data after acquireing lock, before deletion
-                    st.session_state["user_tags"] = SheetManager.fetch(st.session_state["sheet_id"], "user_tags")
-
-                    # * Delete the selected tags
-                    SheetManager.delete_row(
+                    # * Delete the selected tags by _tagId
+                    tag_ids = st.session_state["user_tags"][
+                                    (st.session_state["user_tags"]["_tag"].isin(tags_to_delete))
+                                ]["_tagId"].tolist()
+                    deleted = IndexManager.delete_by_key(
                                 sheet_id = st.session_state["sheet_id"],
-                                worksheet_name = "user_tags",
-                                row_idxs = st.session_state["user_tags"][
-                                            (st.session_state["user_tags"]["_tag"].isin(tags_to_delete))
-                                        ].index
+                                worksheet = "user_tags",
+                                key_column = "_tagId",
+                                keys = tag_ids
                                 )
                     # * Update the tag for all files of the deleted tag to "default"
-                    SheetManager.update(
-                        sheet_id = st.session_state["sheet_id"],
-                        worksheet_name = "user_docs",
-                        row_idxs = st.session_state["user_docs"][
-                                    (st.session_state["user_docs"]["_tag"].isin(tags_to_delete))
-                                ].index,
-                        column = "_tag",
-                        values = ["default" for _ in st.session_state["user_docs"][
+                    retag = {file_id: {"_tag": "default"} for file_id in st.session_state["user_docs"][
                                     (st.session_state["user_docs"]["_tag"].isin(tags_to_delete))
-                                ].index]
-                        
+                                ]["_fileId"]}
+                    results = IndexManager.update_by_key(
+                        sheet_id = st.session_state["sheet_id"],
+                        worksheet = "user_docs",
+                        key_column = "_fileId",
+                        changes = retag
                     )
                     
                     # * Release the lock
-                    SheetManager.release_lock(st.session_state["sheet_id"], "user_tags")
+                    StorageManager.backend().release_lock(st.session_state["sheet_id"], "user_tags")
 
-                    del st.session_state["user_tags"]
-                    del st.session_state["user_docs"]
+                    # * Patch the session's tables (reload them if some rows were not written)
+                    if deleted and len(results) == len(retag):
+                        SessionManager.tags_deleted(tag_ids)
+                    else:
+                        SessionManager.invalidate("user_tags", "user_docs")
                     time.sleep(1)
                     st.rerun()
 
@@ -375,41 +394,6 @@ else:
         st.warning("This account does not have database configured. Click the following button to set up your database!")
         st.stop()
 
-    if "sheet_id" not in st.session_state:
-        st.session_state["sheet_id"] = SheetManager.extract_sheet_id(st.session_state["_dbURL"])  # * initialized in user_manager!
-
-    if "user_docs" not in st.session_state:
-        with st.spinner("loading literature..."):
-            st.session_state['user_docs'] = SheetManager.fetch(st.session_state["sheet_id"], "user_docs")
-
-    if "user_tags" not in st.session_state:
-        with st.spinner("loading tags..."):
-            st.session_state["user_tags"] = SheetManager.fetch(st.session_state["sheet_id"], "user_tags") 
-
-    if "user_chats" not in st.session_state:
-        with st.spinner("loading chat histories..."):
-            st.session_state["user_chats"] = SheetManager.fetch(st.session_state["sheet_id"], "user_chats") 
-
-    if "messages" not in st.session_state:
-        with st.spinner("parsing chat histories..."):
-            st.session_state["messages"] = {}
-            for _, row in st.session_state['user_docs'].iterrows():
-                doc_id = row["_fileId"]
-                doc_name = row["_fileName"]
-                st.session_state["messages"].update({
-                    doc_id: {
-                        "doc_name": doc_name,
-                        "chat_history": [
-                            {
-                                "role": row["_role"],
-                                "content": row["_content"],
-                                "model": row["_model"],
-                                "time": row["_time"]
-                            }
-                            for _, row in st.session_state['user_chats'][st.session_state['user_chats']["_fileId"] == doc_id].iterrows()
-                        ] if not st.session_state['user_chats'][st.session_state['user_chats']["_fileId"] == doc_id].empty
-                        else []
-                    }
-                })
+    BootstrapManager.run()     # * sheet_id, user_docs / user_tags and the chat histories (built when first read)
 
     main()
\ No newline at end of file
@@ -1,6 +1,8 @@
 from utils.data_manager import DataManager
 from utils.prompt_manager import PromptManager
 from utils.sheet_manager import SheetManager, GoogleSheetDB
+from utils.bootstrap_manager import BootstrapManager
+from utils.session_manager import SessionManager
 from utils.user_manager import UserManager
 from utils.docs_manager import PineconeManager
 from utils.others import Others
@@ -80,10 +82,7 @@ def main():
     with st.sidebar:
         if st.button("Refresh", "reload", icon = ":material/refresh:", width = "stretch"):
             del st.session_state["pdfs_raw"]
-            del st.session_state["user_docs"]
-            del st.session_state["user_tags"]
-            del st.session_state["user_chats"]
-            del st.session_state["messages"]
+            BootstrapManager.refresh()     # * only reloads if the database changed
             st.rerun()
             
         st.caption(f"Logged in as: **{st.session_state['user_id']}**")
@@ -112,7 +111,6 @@ def main():
             st.stop()
 
         # * Check the sheet link
-        client = SheetManager.authenticate_google_sheets()
         sheet_id = SheetManager.extract_sheet_id(st.session_state['_dbURL'])
         if sheet_id == None:
             st.stop()
@@ -189,7 +187,7 @@ def main():
         # ** Complete message
         st.success("Literature uploaded and being summarized. Please check the result in **Literature Management** page or **Chat with Literature** page later.")
         time.sleep(1.5)
-        del st.session_state["user_docs"]
+        SessionManager.invalidate("user_docs")     # * the summaries are appended by the backend
         del st.session_state["pdfs_raw"]
         st.rerun()  
 
@@ -259,41 +257,6 @@ else:
         st.warning("This account does not have database configured. Click the following button to set up your database!")
         st.stop()
 
-    if "sheet_id" not in st.session_state:
-        st.session_state["sheet_id"] = SheetManager.extract_sheet_id(st.session_state["_dbURL"])  # * initialized in user_manager!
-
-    if "user_docs" not in st.session_state:
-        with st.spinner("loading literature..."):
-            st.session_state['user_docs'] = SheetManager.fetch(st.session_state["sheet_id"], "user_docs")
-
-    if "user_tags" not in st.session_state:
-        with st.spinner("loading tags..."):
-            st.session_state["user_tags"] = SheetManager.fetch(st.session_state["sheet_id"], "user_tags") 
-
-    if "user_chats" not in st.session_state:
-        with st.spinner("loading chat histories..."):
-            st.session_state["user_chats"] = SheetManager.fetch(st.session_state["sheet_id"], "user_chats") 
-
-    if "messages" not in st.session_state:
-        with st.spinner("parsing chat histories..."):
-            st.session_state["messages"] = {}
-            for _, row in st.session_state['user_docs'].iterrows():
-                doc_id = row["_fileId"]
-                doc_name = row["_fileName"]
-                st.session_state["messages"].update({
-                    doc_id: {
-                        "doc_name": doc_name,
-                        "chat_history": [
-                            {
-                                "role": row["_role"],
-                                "content": row["_content"],
-                                "model": row["_model"],
-                                "time": row["_time"]
-                            }
-                            for _, row in st.session_state['user_chats'][st.session_state['user_chats']["_fileId"] == doc_id].iterrows()
-                        ] if not st.session_state['user_chats'][st.session_state['user_chats']["_fileId"] == doc_id].empty
-                        else []
-                    }
-                })
+    BootstrapManager.run()     # * sheet_id, user_docs / user_tags and the chat histories (built when first read)
 
     main()
\ No newline at end of file
@@ -0,0 +1,156 @@
+import streamlit as st
+import hashlib
+import sqlite3
+import threading
+import zlib
+import os
+from utils.cache_manager import LRUCache
+
+
+class BlobStore:
+    """Content-addressed byte store; keys are SHA-256 hex digests of the uncompressed value."""
+
+    name = None
+
+    def get(self, key) -> bytes | None:
+        raise NotImplementedError
+
+    def put(self, key, data: bytes):
+        raise NotImplementedError
+
+
+class FileBlobStore(BlobStore):
+    """One file per blob under `root`, sharded by the first two hex digits."""
+
+    name = "file"
+
+    def __init__(self, root = "./.easyessay/blobs"):
+        self.root = root
+        os.makedirs(root, exist_ok = True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        path = self._path(key)
+        if os.path.exists(path):
+            return                              # * same content, same key
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+class SQLiteBlobStore(BlobStore):
+    """All blobs in a single SQLite file."""
+
+    name = "sqlite"
+
+    def __init__(self, path = "./.easyessay/blobs.sqlite3"):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS "blobs" ("key" TEXT PRIMARY KEY, "data" BLOB)')
+        finally:
+            conn.close()
+
+    def get(self, key):
+        conn = sqlite3.connect(self.path, timeout = 10)
+        try:
+            row = conn.execute('SELECT "data" FROM "blobs" WHERE "key" = ?', (key,)).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def put(self, key, data):
+        conn = sqlite3.connect(self.path, timeout = 10)
+        try:
+            with conn:
+                conn.execute('INSERT OR IGNORE INTO "blobs" ("key", "data") VALUES (?, ?)', (key, data))
+        finally:
+            conn.close()
+
+
+class BlobManager:
+    """
+    Keeps large cell values (summary HTML, long chat answers) out of the sheet.
+
+    A value too long for a cell (over `inline_limit`) is zlib-compressed into the blob store and the cell
+    only holds a reference "blob:sha256:<digest>:<length>". The store is local to the app server, so every
+    value that fits stays in the user's sheet. Readers call `resolve`, which passes ordinary values
+    through and loads referenced ones through an LRU cache. The store is picked from st.secrets:
+
+        [blobs]
+        backend = "file"        # or "sqlite"
+        path = "./.easyessay/blobs"
+    """
+
+    prefix       = "blob:sha256:"
+    inline_limit = 45000          # characters; Sheets caps a cell at 50,000
+    missing      = "*[This content is not available: it was stored on a server that no longer has it.]*"
+    stores = {
+        "file": FileBlobStore,
+        "sqlite": SQLiteBlobStore
+    }
+
+    _store  = None
+    _lock   = threading.Lock()
+    _values = LRUCache(maxsize = 512)
+
+    @staticmethod
+    def store() -> BlobStore:
+        with BlobManager._lock:
+            if BlobManager._store is None:
+                config = st.secrets.get("blobs", {})
+                store_cls = BlobManager.stores[config.get("backend", "file")]
+                BlobManager._store = store_cls(config["path"]) if "path" in config else store_cls()
+            return BlobManager._store
+
+    @staticmethod
+    def is_ref(value):
+        return isinstance(value, str) and value.startswith(BlobManager.prefix)
+
+    @staticmethod
+    def ref_length(value):
+        """Length of the referenced value, read from the reference itself (no blob load)."""
+        return int(value.rsplit(":", 1)[1]) if BlobManager.is_ref(value) else len(str(value))
+
+    @staticmethod
+    def pack(value):
+        """:return: `value` itself if short enough, otherwise a reference to it in the blob store."""
+        if not isinstance(value, str) or len(value) <= BlobManager.inline_limit:
+            return value
+        data = value.encode("utf-8")
+        key = hashlib.sha256(data).hexdigest()
+        BlobManager.store().put(key, zlib.compress(data))
+        BlobManager._values.set(key, value)
+        return f"{BlobManager.prefix}{key}:{len(value)}"
+
+    @staticmethod
+    def resolve(value):
+        """:return: the original value of a reference (`missing` if the blob is gone); other values unchanged."""
+        if not BlobManager.is_ref(value):
+            return value
+        key = value[len(BlobManager.prefix):].split(":", 1)[0]
+        cached = BlobManager._values.get(key)
+        if cached is not None:
+            return cached
+        data = BlobManager.store().get(key)
+        if data is None:
+            return BlobManager.missing
+        text = zlib.decompress(data).decode("utf-8")
+        BlobManager._values.set(key, text)
+        return text
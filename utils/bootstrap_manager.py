@@ -0,0 +1,286 @@
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import pandas as pd
+import threading
+import time
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from utils.data_manager import DataManager
+from utils.blob_manager import BlobManager
+from utils.queue_manager import QueueManager
+from utils.sheet_manager import SheetManager
+from utils.snapshot_manager import SnapshotManager
+from utils.storage_manager import StorageManager
+
+
+@dataclass
+class BootstrapSnapshot:
+    """Tables loaded for a session; a table that was not requested stays None."""
+    user_docs: pd.DataFrame | None = None
+    user_tags: pd.DataFrame | None = None
+    user_chats: pd.DataFrame | None = None
+    revision: str | None = None                                    # database revision taken before the reads
+    timings: dict[str, float] = field(default_factory = dict)     # seconds per table
+    total: float = 0.0                                             # wall time of the whole load
+
+    def frames(self) -> dict[str, pd.DataFrame]:
+        return {name: getattr(self, name) for name in BootstrapManager.loadable if getattr(self, name) is not None}
+
+
+class LazyMessages(MutableMapping):
+    """
+    st.session_state["messages"]: doc_id -> {"doc_name", "chat_history"} for every document of user_docs.
+    An entry is built the first time it is read and then kept: from the user_chats frame if the session
+    has one, else from the document's own chat partition (one small read). values() / items() (e.g. the
+    export) build every remaining entry from one read of the whole table. When user_docs changes, `sync`
+    follows it and keeps the entries already built.
+    """
+
+    def __init__(self, doc_names: dict, sheet_id = None, user_chats: pd.DataFrame | None = None):
+        self._names     = dict(doc_names)    # * doc_id -> doc_name, in user_docs order
+        self._listed    = set(doc_names)     # * documents that came from user_docs (not assigned by a page)
+        self._entries   = {}
+        self.docs       = None               # * the user_docs frame the mapping was last synced with
+        self._sheet_id  = sheet_id
+        self._chats     = user_chats
+        self._positions = None               # * doc_id -> row positions in _chats
+
+    def _history(self, doc_id):
+        """:return: the chat_history of a document, or None if its chats could not be read."""
+        if self._chats is None:
+            QueueManager.flush(self._sheet_id)     # * chat rows still in the write-behind queue
+            frame = StorageManager.backend().fetch(self._sheet_id, SheetManager.partition_name("user_chats", doc_id))
+            if len(frame.columns) == 0:
+                return None
+        else:
+            if self._positions is None:
+                has_rows = len(self._chats) and "_fileId" in self._chats.columns
+                self._positions = self._chats.groupby("_fileId", sort = False).indices if has_rows else {}
+            frame = self._chats.iloc[self._positions.get(doc_id, [])]
+        return [record for _, record in BootstrapManager.chat_records(frame)]
+
+    def __getitem__(self, doc_id):
+        if doc_id in self._entries:
+            return self._entries[doc_id]
+        if doc_id not in self._names:
+            raise KeyError(doc_id)
+        history = self._history(doc_id)
+        entry = {"doc_name": self._names[doc_id], "chat_history": history or []}
+        if history is not None:
+            self._entries[doc_id] = entry       # * a failed read is retried on the next access
+        return entry
+
+    def __setitem__(self, doc_id, entry):
+        self._names.setdefault(doc_id, entry.get("doc_name"))
+        self._entries[doc_id] = entry
+
+    def __delitem__(self, doc_id):
+        del self._names[doc_id]
+        self._entries.pop(doc_id, None)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._names          # * without building the entry
+
+    def __iter__(self):
+        return iter(list(self._names))
+
+    def __len__(self):
+        return len(self._names)
+
+    def sync(self, doc_names: dict):
+        """Add documents new in user_docs and forget the ones no longer in it."""
+        for doc_id in self._listed - set(doc_names):
+            self._names.pop(doc_id, None)
+            self._entries.pop(doc_id, None)
+        for doc_id, doc_name in doc_names.items():
+            self._names.setdefault(doc_id, doc_name)
+        self._listed = set(doc_names)
+
+    @property
+    def built(self):
+        """Number of entries built so far."""
+        return len(self._entries)
+
+    def load_all(self):
+        missing = [doc_id for doc_id in self._names if doc_id not in self._entries]
+        if not missing:
+            return
+        chats = self._chats
+        if chats is None:
+            QueueManager.flush(self._sheet_id)
+            chats = StorageManager.backend().fetch(self._sheet_id, "user_chats")
+            if len(chats.columns) == 0:
+                return      # * the read failed: nothing is built, the next access retries
+            self._chats, self._positions = chats, None
+        docs = pd.DataFrame({"_fileId": missing, "_fileName": [self._names[doc_id] for doc_id in missing]})
+        self._entries.update(BootstrapManager.build_messages(docs, chats))
+
+    def values(self):
+        self.load_all()
+        return super().values()
+
+    def items(self):
+        self.load_all()
+        return super().items()
+
+
+class BootstrapManager:
+    """
+    Everything a logged-in page needs before rendering (see `run`). The tables are loaded concurrently,
+    so the first page costs about one round trip; chat histories are read per document when first used
+    (see LazyMessages). The workers share the process-wide client: gspread sends requests through a
+    pooled (thread-safe) urllib3 connection pool, and the handle / read caches are locked.
+    """
+
+    tables   = ["user_docs", "user_tags"]      # * loaded for every session
+    loadable = tables + ["user_chats"]
+
+    # * user_chats column -> key of a chat_history entry
+    message_fields = {"_role": "role", "_content": "content", "_model": "model", "_time": "time"}
+    _pool = ThreadPoolExecutor(max_workers = 8, thread_name_prefix = "bootstrap")
+
+    @staticmethod
+    def _load_table(sheet_id, name):
+        backend = StorageManager.backend()
+        if name == "user_docs":
+            return backend.fetch(sheet_id, "user_docs", columns = DataManager.docs_list_columns)
+        if name == "user_chats":
+            QueueManager.flush(sheet_id)     # * chat rows still in the write-behind queue
+            return backend.fetch(sheet_id, "user_chats")    # * all per-document partitions at once
+        return backend.fetch(sheet_id, name)
+
+    @staticmethod
+    def load(sheet_id, names = None) -> BootstrapSnapshot:
+        """Fetch `names` (`tables` by default, any of `loadable`) in parallel and time each fetch."""
+        names = BootstrapManager.tables if names is None else list(names)
+        ctx = get_script_run_ctx()
+        snapshot = BootstrapSnapshot()
+
+        def task(name):
+            # * lets st.* calls inside the fetch (e.g. error messages) reach this session
+            add_script_run_ctx(threading.current_thread(), ctx)
+            start = time.perf_counter()
+            frame = BootstrapManager._load_table(sheet_id, name)
+            return frame, time.perf_counter() - start
+
+        start = time.perf_counter()
+        # * taken before the reads, so that a write racing with them shows up as a newer revision later
+        snapshot.revision = StorageManager.backend().revision(sheet_id)
+        futures = {name: BootstrapManager._pool.submit(task, name) for name in names}
+        for name, future in futures.items():
+            frame, elapsed = future.result()
+            setattr(snapshot, name, frame)
+            snapshot.timings[name] = elapsed
+        snapshot.total = time.perf_counter() - start
+        return snapshot
+
+    @staticmethod
+    def ensure_loaded():
+        """
+        Load the tables missing from st.session_state; timings go to st.session_state["bootstrap_timings"].
+        A new session starts from the on-disk snapshot when there is one (checked in the background, see
+        SnapshotManager); every full load writes a new snapshot.
+        """
+        missing = [name for name in BootstrapManager.tables if name not in st.session_state]
+        if not missing:
+            return None
+        sheet_id = st.session_state["sheet_id"]
+        full = len(missing) == len(BootstrapManager.tables)
+
+        if full:
+            start = time.perf_counter()
+            cached = SnapshotManager.load(sheet_id, missing)
+            if cached is not None:
+                revision, frames = cached
+                st.session_state.update(frames)
+                st.session_state["bootstrap_revision"] = revision
+                st.session_state["bootstrap_timings"] = {"snapshot": time.perf_counter() - start, "total": time.perf_counter() - start}
+                SnapshotManager.check(sheet_id, revision)
+                return None
+
+        with st.spinner("loading literature and tags..."):
+            snapshot = BootstrapManager.load(sheet_id, missing)
+        st.session_state.update(snapshot.frames())
+        st.session_state["bootstrap_timings"] = {**snapshot.timings, "total": snapshot.total}
+        # * a partial reload leaves older tables next to it, so the session only has a revision after a full load
+        if full and snapshot.revision is not None:
+            st.session_state["bootstrap_revision"] = snapshot.revision
+            frames = {name: frame.copy() for name, frame in snapshot.frames().items()}     # * pages may edit theirs in place
+            BootstrapManager._pool.submit(SnapshotManager.save, sheet_id, snapshot.revision, frames)
+        else:
+            st.session_state.pop("bootstrap_revision", None)
+            SnapshotManager.drop(sheet_id)     # * the session changed the data; the snapshot is outdated
+        return snapshot
+
+    @staticmethod
+    def chat_records(user_chats):
+        """(doc_id, chat_history entry) for each row of user_chats, in order; each column is read as a list once."""
+        if not len(user_chats) or "_fileId" not in user_chats.columns:
+            return
+        keys = list(BootstrapManager.message_fields.values())
+        columns = [user_chats[column].tolist() for column in BootstrapManager.message_fields]
+        for doc_id, *values in zip(user_chats["_fileId"].tolist(), *columns):
+            record = dict(zip(keys, values))
+            record["content"] = BlobManager.resolve(record["content"])
+            yield doc_id, record
+
+    @staticmethod
+    def build_messages(user_docs, user_chats):
+        """
+        {doc_id: {"doc_name", "chat_history"}} for every document of user_docs. The chat columns are read
+        as lists once and the rows grouped by _fileId in a single pass, so the cost is O(docs + chats).
+        """
+        if "_fileId" not in user_docs.columns:
+            return {}
+        histories = {}
+        for doc_id, record in BootstrapManager.chat_records(user_chats):
+            histories.setdefault(doc_id, []).append(record)
+        return {
+            doc_id: {"doc_name": doc_name, "chat_history": histories.get(doc_id, [])}
+            for doc_id, doc_name in zip(user_docs["_fileId"].tolist(), user_docs["_fileName"].tolist())
+        }
+
+    @staticmethod
+    def ensure_messages():
+        docs = st.session_state["user_docs"]
+        messages = st.session_state.get("messages")
+        if messages is not None and messages.docs is docs:
+            return
+        doc_names = dict(zip(docs["_fileId"].tolist(), docs["_fileName"].tolist())) if "_fileId" in docs.columns else {}
+        if messages is None:
+            messages = st.session_state["messages"] = LazyMessages(doc_names, st.session_state["sheet_id"], st.session_state.get("user_chats"))
+        else:
+            messages.sync(doc_names)     # * user_docs was reloaded or patched
+        messages.docs = docs
+
+    @staticmethod
+    def run():
+        """Set up a logged-in session: sheet_id, then user_docs / user_tags, then the (lazy) messages."""
+        if "sheet_id" not in st.session_state:
+            st.session_state["sheet_id"] = SheetManager.extract_sheet_id(st.session_state["_dbURL"])  # * initialized in user_manager!
+        if SnapshotManager.is_stale(st.session_state["sheet_id"], st.session_state.get("bootstrap_revision")):
+            BootstrapManager._drop_session()     # * started from an outdated snapshot
+        BootstrapManager.ensure_loaded()
+        BootstrapManager.ensure_messages()
+
+    @staticmethod
+    def refresh():
+        """
+        Refresh button: drop the session's tables (and the messages parsed from them) only if the
+        database revision differs from the one they were loaded at.
+        :return: True if the tables will be reloaded.
+        """
+        backend = StorageManager.backend()
+        revision = backend.revision(st.session_state["sheet_id"])
+        if revision is not None and revision == st.session_state.get("bootstrap_revision"):
+            return False
+        backend.invalidate(st.session_state["sheet_id"])
+        BootstrapManager._drop_session()
+        return True
+
+    @staticmethod
+    def _drop_session():
+        """Forget the session's tables and what was built from them, so that the next run reloads them."""
+        for name in BootstrapManager.loadable + ["messages", "bootstrap_revision"]:
+            st.session_state.pop(name, None)
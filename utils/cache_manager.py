@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded LRU mapping shared across Streamlit sessions.
+    Streamlit serves every session from the same process, so anything stored here is process-wide.
+    """
+
+    def __init__(self, maxsize = 128):
+        self.maxsize = maxsize
+        self._data   = OrderedDict()
+        self._lock   = threading.RLock()
+
+    def get(self, key, default = None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+
+    def pop(self, key, default = None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def pop_where(self, predicate):
+        """Drop every entry whose key satisfies `predicate`; returns the number of entries dropped."""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class TTLCache(LRUCache):
+    """LRUCache whose entries also expire `ttl` seconds after they were set."""
+
+    def __init__(self, maxsize = 128, ttl = 60):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key, default = None):
+        with self._lock:
+            entry = super().get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                self._data.pop(key, None)
+                return default
+            return value
+
+    def set(self, key, value):
+        super().set(key, (time.monotonic() + self.ttl, value))
+
+    def pop(self, key, default = None):
+        entry = super().pop(key)
+        return default if entry is None else entry[1]
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
@@ -11,6 +11,8 @@ class Consts:
         "llama-3.3-70b"
     ]
 
+    chat_window = 20     # * messages rendered per page of a chat transcript
+
     page_helps = {
         "index": "",
         "page_account": "",
@@ -6,9 +6,17 @@ import string
 import random
 import pandas as pd
 import io
+from utils.cache_manager import LRUCache
+from utils.storage_manager import StorageManager
+from utils.blob_manager import BlobManager
 
 class DataManager:
 
+    # * user_docs columns needed by the lists and selectors; the large HTML `_summary` is loaded lazily
+    docs_list_columns = ["_fileId", "_fileName", "_generatedTime", "_length", "_tag"]
+    _summaries = LRUCache(maxsize = 256)
+    _images = {}
+
     @staticmethod
     @st.dialog("Upload the file with pdf format")
     def FORM_pdf_input():
@@ -68,11 +76,39 @@ class DataManager:
 
         return None  # Return None if no valid JSON is found
     
+    # --- Load one literature summary by _fileId (memoized per process)
+    @staticmethod
+    def get_summary(doc_id):
+        sheet_id = st.session_state["sheet_id"]
+        summary = DataManager._summaries.get((sheet_id, doc_id))
+        if summary is not None:
+            return summary
+
+        backend = StorageManager.backend()
+        docs = st.session_state["user_docs"]
+        idxs = docs.index[docs["_fileId"] == doc_id].tolist()
+        cells = backend.fetch_cells(sheet_id, "user_docs", idxs[:1], ["_fileId", "_summary"]).get(idxs[0], {}) if idxs else {}
+        if cells.get("_fileId") != doc_id:
+            # * rows moved since user_docs was loaded (e.g. deleted in another session): locate the doc again
+            ids = backend.fetch(sheet_id, "user_docs", columns = ["_fileId"])
+            idxs = ids.index[ids["_fileId"] == doc_id].tolist()
+            if not idxs:
+                return None
+            cells = backend.fetch_cells(sheet_id, "user_docs", idxs[:1], ["_fileId", "_summary"]).get(idxs[0], {})
+
+        summary = BlobManager.resolve(cells.get("_summary"))       # * may be stored out of line (see BlobManager)
+        if summary:
+            DataManager._summaries.set((sheet_id, doc_id), summary)
+        return summary
+
     # --- Transform Picture to Base64
     @staticmethod
     def image_to_b64(image_path):
-        with open(image_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode("utf-8")
+        # * static assets: encoded once per process, not on every rerun
+        if image_path not in DataManager._images:
+            with open(image_path, "rb") as img_file:
+                DataManager._images[image_path] = base64.b64encode(img_file.read()).decode("utf-8")
+        return DataManager._images[image_path]
     
     # --- Generate a random index for document
     @staticmethod
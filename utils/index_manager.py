@@ -0,0 +1,154 @@
+import threading
+from utils.cache_manager import LRUCache
+from utils.storage_manager import StorageManager
+
+
+class KeyIndex:
+    """Row-ordered key column of one worksheet, with key -> DataFrame row indices."""
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        self.rows = {}
+        for idx, key in enumerate(self.keys):
+            self.rows.setdefault(key, []).append(idx)
+
+    def extend(self, keys):
+        for key in keys:
+            self.rows.setdefault(key, []).append(len(self.keys))
+            self.keys.append(key)
+
+    def remove(self, row_idxs):
+        """Drop rows; rows below them move up, exactly like in the sheet."""
+        dropped = set(row_idxs)
+        self.__init__([key for idx, key in enumerate(self.keys) if idx not in dropped])
+
+
+class IndexManager:
+    """
+    Row mutations addressed by primary key (`_fileId`, `_tagId`) instead of DataFrame index.
+
+    Each (sheet_id, worksheet, key column) has a process-wide KeyIndex. Before a write the index is
+    checked against the sheet by reading only a few key cells in one request: the target rows, the
+    rows just around them, and the last indexed row plus the one after it. Rows appended meanwhile are
+    read from the tail and added to the index. Anything else (rows deleted by someone else) fails the
+    check and the key column is re-read. Deletes through this class update the index in place.
+    Callers hold the worksheet lock, as for every other mutation; `_lock` only guards the in-memory
+    indexes, never a network call. Every method takes an optional `backend` (StorageManager.backend()
+    by default), e.g. for the replica's sync worker.
+    """
+
+    _indexes = LRUCache(maxsize = 256)
+    _lock    = threading.RLock()
+
+    @staticmethod
+    def _build(sheet_id, worksheet, key_column, backend):
+        frame = backend.fetch(sheet_id, worksheet, columns = [key_column], cache = False)
+        if key_column not in frame.columns:
+            raise RuntimeError(f"Could not read {worksheet}.{key_column}")
+        index = KeyIndex(frame[key_column].tolist())
+        IndexManager._indexes.set((backend.name, sheet_id, worksheet, key_column), index)
+        return index
+
+    @staticmethod
+    def _extend_tail(sheet_id, worksheet, key_column, index, backend):
+        n = len(index.keys)
+        frame = backend.fetch(sheet_id, worksheet, columns = [key_column], rows = slice(n, None), cache = False)
+        if key_column not in frame.columns:
+            raise RuntimeError(f"Could not read {worksheet}.{key_column}")
+        with IndexManager._lock:
+            if len(index.keys) == n:             # * not extended by another session meanwhile
+                index.extend(frame[key_column].tolist())
+
+    @staticmethod
+    def _verify(sheet_id, worksheet, key_column, index, row_idxs, backend):
+        """
+        Compare the index with the sheet at `row_idxs`, their neighbours and the table end.
+        :return: "ok", "appended" (rows were added after the indexed ones) or "stale".
+        """
+        with IndexManager._lock:
+            keys = list(index.keys)
+        n = len(keys)
+        probes = set(row_idxs) | {n - 1, n}
+        for idx in row_idxs:
+            probes.update([idx - 1, idx + 1])
+        probes = sorted(idx for idx in probes if 0 <= idx <= n)
+
+        cells = backend.fetch_cells(sheet_id, worksheet, probes, [key_column])
+        for idx in probes:
+            actual = cells.get(idx, {}).get(key_column, "")
+            expected = keys[idx] if idx < n else ""
+            if actual != expected:
+                return "appended" if idx == n else "stale"
+        return "ok"
+
+    @staticmethod
+    def locate(sheet_id, worksheet, key_column, keys, backend = None):
+        """
+        :return: {key: [row_idx, ...]} for the keys found, checked against the sheet.
+        Keys that do not exist in the sheet are left out. Raises RuntimeError if the sheet cannot be read.
+        """
+        backend = backend or StorageManager.backend()
+        index = IndexManager._indexes.get((backend.name, sheet_id, worksheet, key_column))
+        if index is None:
+            index = IndexManager._build(sheet_id, worksheet, key_column, backend)
+
+        for attempt in range(3):
+            with IndexManager._lock:
+                found = {key: list(index.rows[key]) for key in keys if key in index.rows}
+            row_idxs = [idx for idxs in found.values() for idx in idxs]
+            status = IndexManager._verify(sheet_id, worksheet, key_column, index, row_idxs, backend)
+            if status == "ok" and (len(found) == len(set(keys)) or attempt):
+                return found
+            if status == "appended":
+                IndexManager._extend_tail(sheet_id, worksheet, key_column, index, backend)
+            else:
+                # * stale, or keys missing from an index built before they were added
+                index = IndexManager._build(sheet_id, worksheet, key_column, backend)
+        with IndexManager._lock:
+            return {key: list(index.rows[key]) for key in keys if key in index.rows}
+
+    @staticmethod
+    def update_by_key(sheet_id, worksheet, key_column, changes: dict, backend = None):
+        """
+        :param changes: {key: {column: value}}; every row holding the key gets the values.
+        :return: per-cell results of the backend update (one per cell written; empty if the rows could not be located).
+        """
+        backend = backend or StorageManager.backend()
+        try:
+            found = IndexManager.locate(sheet_id, worksheet, key_column, list(changes), backend)
+        except RuntimeError:
+            IndexManager._indexes.pop((backend.name, sheet_id, worksheet, key_column))
+            return []
+        cells = [(idx, column, value)
+                 for key, idxs in found.items()
+                 for idx in idxs
+                 for column, value in changes[key].items()]
+        if not cells:
+            return []
+        return backend.update(sheet_id, worksheet, cells = cells)
+
+    @staticmethod
+    def delete_by_key(sheet_id, worksheet, key_column, keys, backend = None):
+        """
+        Delete every row holding one of `keys`.
+        :return: True if the rows were deleted (or none existed), False otherwise.
+        """
+        backend = backend or StorageManager.backend()
+        cache_key = (backend.name, sheet_id, worksheet, key_column)
+        try:
+            found = IndexManager.locate(sheet_id, worksheet, key_column, list(keys), backend)
+        except RuntimeError:
+            IndexManager._indexes.pop(cache_key)
+            return False
+        row_idxs = sorted(idx for idxs in found.values() for idx in idxs)
+        if not row_idxs:
+            return True
+        located = IndexManager._indexes.get(cache_key)
+        deleted = backend.delete_row(sheet_id, worksheet, row_idxs)
+        with IndexManager._lock:
+            index = IndexManager._indexes.get(cache_key)
+            if deleted and index is not None and index is located:
+                index.remove(row_idxs)
+            else:
+                IndexManager._indexes.pop(cache_key)     # * rebuilt on the next use
+        return deleted
@@ -0,0 +1,92 @@
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+
+class LockManager:
+    """
+    Lease locks shared by the storage backends.
+
+    A lease has:
+    - owner:   per-session token (user id + random suffix), so sessions sharing the guest account do not
+               mistake each other's lock for their own.
+    - expiry:  unix time after which the lease is free again, so a crashed session cannot block others forever.
+    SQLite stores one lease per worksheet with a version column and takes it with a compare-and-set
+    (UPDATE ... WHERE version = ?). Sheets has no conditional write, so there a lock is a queue of claim
+    rows, ordered by the order in which Sheets applied the appends (see `live_claims`).
+    """
+
+    free_owner    = "Unlocked"
+    process_owner = f"worker:{socket.gethostname()}:{os.getpid()}"     # background threads of this process
+    lease_ttl     = 60        # seconds
+    base_delay    = 0.25      # seconds; first backoff step
+    max_delay     = 4.0       # seconds; backoff cap
+
+    _stats = {}               # worksheet -> contention metrics
+    _stats_lock = threading.Lock()
+
+    @staticmethod
+    def owner():
+        """Lock owner token of the current session (or of the process, outside of a script run)."""
+        if get_script_run_ctx() is None:
+            return LockManager.process_owner
+        if "lock_owner" not in st.session_state:
+            st.session_state["lock_owner"] = f"{st.session_state['user_id']}:{uuid.uuid4().hex[:8]}"
+        return st.session_state["lock_owner"]
+
+    @staticmethod
+    def live_claims(rows, now = None):
+        """
+        Live claims of a lock queue, oldest first; the first one holds the lock.
+        A row is a claim [owner, expiry, claim id], or [free_owner, 0, claim id] releasing that claim.
+        A claim is live until it is released or expires; a claim appended twice (retried request) counts once.
+        :param rows: rows of the queue in worksheet order, without the header.
+        :return: [(row position, owner, claim id)]
+        """
+        now = time.time() if now is None else now
+        released = {row[2] for row in rows if len(row) >= 3 and row[0] == LockManager.free_owner}
+        live, seen = [], set()
+        for position, row in enumerate(rows):
+            if len(row) < 3 or row[0] == LockManager.free_owner or row[2] in released or row[2] in seen:
+                continue
+            try:
+                expiry = float(row[1])
+            except ValueError:
+                continue
+            seen.add(row[2])
+            if expiry >= now:
+                live.append((position, row[0], row[2]))
+        return live
+
+    @staticmethod
+    def is_available(owner, expiry, me, now = None):
+        """A lease can be taken if it is free, expired, or already ours (renewal)."""
+        now = time.time() if now is None else now
+        return owner == LockManager.free_owner or owner == me or expiry < now
+
+    @staticmethod
+    def backoff(attempt):
+        """Jittered exponential backoff ("full jitter")."""
+        return random.uniform(0, min(LockManager.max_delay, LockManager.base_delay * 2 ** attempt))
+
+    @staticmethod
+    def record(worksheet_name, acquired, waited, attempts):
+        with LockManager._stats_lock:
+            stats = LockManager._stats.setdefault(worksheet_name, {
+                "acquired": 0, "failed": 0, "contended": 0, "total_wait": 0.0, "max_wait": 0.0
+            })
+            stats["acquired" if acquired else "failed"] += 1
+            stats["contended"] += attempts > 1
+            stats["total_wait"] += waited
+            stats["max_wait"] = max(stats["max_wait"], waited)
+
+    @staticmethod
+    def metrics():
+        """Contention metrics per worksheet since the process started."""
+        with LockManager._stats_lock:
+            return {name: dict(stats) for name, stats in LockManager._stats.items()}
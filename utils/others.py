@@ -1,13 +1,66 @@
 import streamlit as st
 import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 class Others:
 
+    # * Status probes run in the background; pages render the last known result at once.
+    # * Results are shared by every session and refreshed at most every `probe_ttl` seconds.
+    probe_ttl     = 60       # seconds
+    probe_timeout = 3        # seconds per HTTP request
+    _probes       = {}       # name -> (checked_at, result)
+    _running      = set()
+    _probe_lock   = threading.Lock()
+    _probe_pool   = ThreadPoolExecutor(max_workers = 2, thread_name_prefix = "status-probe")
+
+    @staticmethod
+    def probe(name, fn):
+        """
+        :return: the last result of `fn` (None before the first one finishes, or if it raised).
+        Starts `fn` in the background when there is no result yet or it is older than `probe_ttl`.
+        """
+        with Others._probe_lock:
+            checked_at, result = Others._probes.get(name, (0.0, None))
+            if time.time() - checked_at >= Others.probe_ttl and name not in Others._running:
+                Others._running.add(name)
+                Others._probe_pool.submit(Others._run_probe, name, fn)
+        return result
+
+    @staticmethod
+    def _run_probe(name, fn):
+        try:
+            result = fn()
+        except Exception:
+            result = None
+        with Others._probe_lock:
+            Others._probes[name] = (time.time(), result)
+            Others._running.discard(name)
+
+    @staticmethod
+    def public_ip():
+        return requests.get("https://api.ipify.org?format=json", timeout = Others.probe_timeout).json()["ip"]
+
+    @staticmethod
+    def backend_healthy():
+        try:
+            return requests.get("https://easyessaybackend.onrender.com/", timeout = Others.probe_timeout).status_code == 200
+        except requests.RequestException:
+            return False
+
     @staticmethod
     def fetch_IP():
-        response = requests.get("https://api.ipify.org?format=json")
-        public_ip = response.json()["ip"]
-        st.caption(f"Deployed IP Address: **:blue[{public_ip}]**")
+        public_ip = Others.probe("ip", Others.public_ip)
+        st.caption(f"Deployed IP Address: **:blue[{public_ip or 'checking...'}]**")
 
-    
\ No newline at end of file
+    @staticmethod
+    def show_backend_health():
+        healthy = Others.probe("backend", Others.backend_healthy)
+        if healthy is None:
+            st.caption("Checking backend server...")
+        elif not healthy:
+            st.warning("Backend server collapsed! Please try again later.")
+        else:
+            st.caption("Backend server is healthy.")
@@ -0,0 +1,215 @@
+import glob
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+import gspread
+from utils.storage_manager import StorageManager
+from utils.quota_manager import QuotaManager
+try:
+    import fcntl
+except ImportError:         # * Windows: a single local process, so one shared journal is enough
+    fcntl = None
+
+
+class QueueManager:
+    """
+    Per-process write-behind queue for append-only rows (chat messages).
+
+    Rows are journaled to disk before `enqueue` returns, and a background thread groups pending rows
+    into one `append_rows` call per (sheet_id, worksheet). Each process has its own journal file and
+    holds an exclusive lock on it, so processes on one host never replay each other's rows. When the
+    queue starts, it adopts the journals nobody holds (left by a process that died) and replays them.
+    A group that keeps failing with an error retrying cannot fix (see `_is_permanent`) is moved to
+    `dead_letter_path` after `max_failures` passes, instead of blocking the queue forever.
+    """
+
+    journal_dir      = "./.easyessay"
+    journal_pattern  = os.path.join(journal_dir, "write_queue*.jsonl")     # * also matches the old shared journal
+    dead_letter_path = os.path.join(journal_dir, "write_queue.dead")
+    flush_interval   = 1.0    # seconds between background flushes
+    max_backoff      = 60.0   # seconds; upper bound of the retry delay when Sheets keeps failing
+    max_failures     = 5      # permanent failures of a row before it is dead-lettered
+
+    journal_path = None       # * this process's journal, set when the queue starts
+    _journal     = None       # * open (and locked) handle of journal_path
+    _pending     = []         # [{"id", "sheet_id", "worksheet", "row", "failures"}], in enqueue order
+    _lock        = threading.Lock()
+    _flush_lock  = threading.Lock()
+    _wakeup      = threading.Event()
+    _worker      = None
+
+    @staticmethod
+    def _try_lock(f):
+        """Take the exclusive lock of an open journal without waiting; True if it is ours now."""
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _adopt(path):
+        """:return: the entries of a journal whose process is gone (removing the file), or [] if it is still held."""
+        try:
+            f = open(path, encoding = "utf-8")
+        except OSError:
+            return []
+        with f:
+            # * the file may have been adopted (and removed) or replaced between open() and the lock
+            if (not QueueManager._try_lock(f) or not os.path.exists(path) or
+                os.stat(path).st_ino != os.fstat(f.fileno()).st_ino):
+                return []
+            entries = []
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue      # torn write from a crash; the row was never acknowledged
+            os.remove(path)
+            return entries
+
+    @staticmethod
+    def _ensure_started():
+        with QueueManager._lock:
+            if QueueManager._worker is not None:
+                return
+            os.makedirs(QueueManager.journal_dir, exist_ok = True)
+            for path in sorted(glob.glob(QueueManager.journal_pattern)):
+                QueueManager._pending.extend(QueueManager._adopt(path))
+            if fcntl is None:
+                QueueManager.journal_path = os.path.join(QueueManager.journal_dir, "write_queue.jsonl")
+            else:
+                QueueManager.journal_path = os.path.join(
+                    QueueManager.journal_dir, f"write_queue-{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl")
+            QueueManager._rewrite_journal()      # * adopted rows now belong to this process
+            QueueManager._worker = threading.Thread(target = QueueManager._run, name = "sheet-write-behind", daemon = True)
+            QueueManager._worker.start()
+
+    @staticmethod
+    def enqueue(sheet_id, worksheet, row: list):
+        """Journal a row and return immediately; it is appended to the sheet in the background."""
+        QueueManager._ensure_started()
+        entry = {"id": uuid.uuid4().hex, "sheet_id": sheet_id, "worksheet": worksheet, "row": row, "failures": 0}
+        with QueueManager._lock:
+            f = QueueManager._journal
+            f.write(json.dumps(entry, ensure_ascii = False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            QueueManager._pending.append(entry)
+        QueueManager._wakeup.set()
+
+    @staticmethod
+    def pending(sheet_id = None):
+        """Number of rows not yet written to storage."""
+        with QueueManager._lock:
+            return sum(1 for e in QueueManager._pending if sheet_id is None or e["sheet_id"] == sheet_id)
+
+    @staticmethod
+    def flush(sheet_id = None, timeout = 10):
+        """
+        Write pending rows now, in the calling thread.
+        :param sheet_id: only wait for the rows of this spreadsheet (all rows if None).
+        :return: True if nothing is left pending, False if `timeout` passed first.
+        """
+        QueueManager._ensure_started()
+        deadline = time.time() + timeout
+        while QueueManager.pending(sheet_id):
+            QueueManager._flush_once()
+            if not QueueManager.pending(sheet_id):
+                break
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.5)
+        return True
+
+    @staticmethod
+    def _flush_once():
+        """One pass over the queue; returns True if every group was written."""
+        with QueueManager._flush_lock:
+            with QueueManager._lock:
+                batch = list(QueueManager._pending)
+            if not batch:
+                return True
+
+            groups = {}
+            for entry in batch:
+                groups.setdefault((entry["sheet_id"], entry["worksheet"]), []).append(entry)
+
+            done, dead, ok = set(), [], True
+            for (sheet_id, worksheet), entries in groups.items():
+                try:
+                    StorageManager.backend().insert_rows(sheet_id, worksheet, [e["row"] for e in entries])
+                    done.update(e["id"] for e in entries)
+                except Exception as e:
+                    ok = False    # keep the rows; retried on the next pass
+                    if QueueManager._is_permanent(e):
+                        for entry in entries:
+                            entry["failures"] = entry.get("failures", 0) + 1
+                            if entry["failures"] >= QueueManager.max_failures:
+                                dead.append({**entry, "error": repr(e), "time": time.time()})
+                                done.add(entry["id"])
+
+            with QueueManager._lock:
+                if dead:
+                    QueueManager._dead_letter(dead)
+                QueueManager._pending = [e for e in QueueManager._pending if e["id"] not in done]
+                QueueManager._rewrite_journal()
+            return ok
+
+    @staticmethod
+    def _is_permanent(error):
+        """Failures that retrying cannot fix: a rejected request (4xx except 401 / 429) or a missing spreadsheet."""
+        if isinstance(error, gspread.exceptions.APIError):
+            status = error.response.status_code
+            return 400 <= status < 500 and status not in (401, 429)
+        return isinstance(error, (gspread.exceptions.SpreadsheetNotFound, gspread.exceptions.WorksheetNotFound,
+                                  KeyError, ValueError))
+
+    @staticmethod
+    def _dead_letter(entries):
+        """Append rows given up on to the dead-letter file, shared by the processes of the host (caller holds `_lock`)."""
+        with open(QueueManager.dead_letter_path, "a", encoding = "utf-8") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            f.write("".join(json.dumps(entry, ensure_ascii = False) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _rewrite_journal():
+        """
+        Replace the journal with the rows still pending (caller holds `_lock`). The new file is locked
+        before it takes the journal's name, so no other process can adopt it.
+        """
+        tmp_path = QueueManager.journal_path + ".tmp"
+        f = open(tmp_path, "w", encoding = "utf-8")
+        QueueManager._try_lock(f)
+        for entry in QueueManager._pending:
+            f.write(json.dumps(entry, ensure_ascii = False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+        os.replace(tmp_path, QueueManager.journal_path)
+        if QueueManager._journal is not None:
+            QueueManager._journal.close()
+        QueueManager._journal = f
+
+    @staticmethod
+    def _run():
+        backoff = QueueManager.flush_interval
+        while True:
+            QueueManager._wakeup.wait(timeout = backoff)
+            QueueManager._wakeup.clear()
+            # * let a burst of messages (user + assistant rows) collect into one batch
+            time.sleep(QueueManager.flush_interval)
+            # * yields Sheets quota to interactive requests (see QuotaManager)
+            with QuotaManager.priority(QuotaManager.BACKGROUND):
+                ok = QueueManager._flush_once()
+            if ok:
+                backoff = QueueManager.flush_interval
+            else:
+                backoff = min(backoff * 2, QueueManager.max_backoff)
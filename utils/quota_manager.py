@@ -0,0 +1,161 @@
+import contextlib
+import contextvars
+import random
+import threading
+import time
+import gspread
+import requests
+from utils.cache_manager import LRUCache
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate     = rate
+        self.capacity = capacity
+        self.tokens   = capacity
+        self.updated  = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Seconds until one token is available (0 if available now)."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class QuotaManager:
+    """
+    Central scheduler for Google Sheets calls.
+
+    Every call takes a token from the service account bucket and from the bucket of its spreadsheet
+    (separately for reads and writes, matching the Sheets "per minute per user" quotas). Interactive
+    calls go first: background calls (e.g. the write-behind queue) wait while any interactive call
+    is waiting. Failures are retried with jittered exponential backoff: 429 always (the request was
+    rejected before it ran), 5xx responses and connection errors only for idempotent calls, since a
+    timed-out append may have been applied and would be applied again.
+    """
+
+    INTERACTIVE = 0
+    BACKGROUND  = 1
+
+    # * requests per minute
+    account_limits = {"read": 60, "write": 60}
+    sheet_limits   = {"read": 60, "write": 60}
+    max_retries    = 5
+    retry_statuses = {429, 500, 502, 503, 504}
+    enabled        = True         # * False skips the buckets (benchmarks against fake APIs)
+
+    _cond      = threading.Condition()
+    _account   = {kind: TokenBucket(limit / 60, limit / 6) for kind, limit in account_limits.items()}   # * bursts of 10 s worth
+    _sheets    = LRUCache(maxsize = 512)
+    _waiting   = {INTERACTIVE: 0, BACKGROUND: 0}
+    _priority  = contextvars.ContextVar("sheets_priority", default = INTERACTIVE)
+    _metrics   = {"calls": 0, "throttled": 0, "throttle_wait": 0.0, "retries": 0, "rate_limited": 0, "failed": 0}
+
+    @staticmethod
+    @contextlib.contextmanager
+    def priority(level):
+        """Run the enclosed Sheets calls with the given priority class."""
+        token = QuotaManager._priority.set(level)
+        try:
+            yield
+        finally:
+            QuotaManager._priority.reset(token)
+
+    @staticmethod
+    def _sheet_bucket(sheet_id, kind):
+        bucket = QuotaManager._sheets.get((sheet_id, kind))
+        if bucket is None:
+            limit = QuotaManager.sheet_limits[kind]
+            bucket = TokenBucket(limit / 60, limit / 6)
+            QuotaManager._sheets.set((sheet_id, kind), bucket)
+        return bucket
+
+    @staticmethod
+    def acquire(sheet_id, kind):
+        """Block until both buckets have a token for this call and no higher-priority call is waiting."""
+        if not QuotaManager.enabled:
+            return
+        level = QuotaManager._priority.get()
+        start = time.monotonic()
+        with QuotaManager._cond:
+            QuotaManager._waiting[level] += 1
+            try:
+                while True:
+                    if level == QuotaManager.BACKGROUND and QuotaManager._waiting[QuotaManager.INTERACTIVE]:
+                        QuotaManager._cond.wait(timeout = 0.5)
+                        continue
+                    buckets = [QuotaManager._account[kind], QuotaManager._sheet_bucket(sheet_id, kind)]
+                    delay = max(b.wait_time() for b in buckets)
+                    if delay == 0:
+                        for b in buckets:
+                            b.take()
+                        break
+                    QuotaManager._cond.wait(timeout = delay)
+            finally:
+                QuotaManager._waiting[level] -= 1
+                QuotaManager._cond.notify_all()
+
+            waited = time.monotonic() - start
+            QuotaManager._metrics["calls"] += 1
+            if waited > 0.01:
+                QuotaManager._metrics["throttled"] += 1
+                QuotaManager._metrics["throttle_wait"] += waited
+
+    @staticmethod
+    def _retry_after(error, attempt):
+        if isinstance(error, gspread.exceptions.APIError):
+            header = error.response.headers.get("Retry-After")
+            if header and header.isdigit():
+                return float(header)
+        return random.uniform(0, min(32.0, 2 ** attempt))
+
+    @staticmethod
+    def _is_retryable(error, idempotent):
+        if isinstance(error, gspread.exceptions.APIError):
+            status = error.response.status_code
+            return status == 429 or (idempotent and status in QuotaManager.retry_statuses)
+        return idempotent and isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    @staticmethod
+    def execute(sheet_id, kind, fn, *args, idempotent = None, **kwargs):
+        """
+        Run one Sheets API call under the quota, retrying transient failures.
+        :param kind: "read" or "write".
+        :param idempotent: whether running the call twice has the effect of running it once; defaults to
+                           True for reads and False for writes (appends, row deletions). Pass True for
+                           writes that only set values, e.g. values.batchUpdate.
+        """
+        idempotent = kind == "read" if idempotent is None else idempotent
+        for attempt in range(QuotaManager.max_retries + 1):
+            QuotaManager.acquire(sheet_id, kind)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not QuotaManager._is_retryable(e, idempotent) or attempt == QuotaManager.max_retries:
+                    with QuotaManager._cond:
+                        QuotaManager._metrics["failed"] += 1
+                    raise
+                with QuotaManager._cond:
+                    QuotaManager._metrics["retries"] += 1
+                    if isinstance(e, gspread.exceptions.APIError) and e.response.status_code == 429:
+                        QuotaManager._metrics["rate_limited"] += 1
+                time.sleep(QuotaManager._retry_after(e, attempt))
+
+    @staticmethod
+    def metrics():
+        """Queue depth and throttling counters since the process started."""
+        with QuotaManager._cond:
+            return {
+                **QuotaManager._metrics,
+                "waiting_interactive": QuotaManager._waiting[QuotaManager.INTERACTIVE],
+                "waiting_background": QuotaManager._waiting[QuotaManager.BACKGROUND]
+            }
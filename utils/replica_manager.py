@@ -0,0 +1,309 @@
+import json
+import os
+import threading
+import time
+from utils.sheet_manager import SheetManager
+from utils.storage_manager import StorageBackend, SQLiteBackend, GoogleSheetBackend
+from utils.index_manager import IndexManager
+from utils.quota_manager import QuotaManager
+
+
+class ReplicaBackend(StorageBackend):
+    """
+    Local-first storage: every read is served by a SQLite copy of the spreadsheet, and the sheet stays
+    the user-owned source of truth.
+
+    - Writes change the local copy and, in the same transaction, append an operation to the `_outbox`
+      table of that copy. Updates and deletes are recorded by primary key (`key_columns`), so they do
+      not depend on row positions, which may differ between the copy and the sheet.
+    - A background worker pushes the outbox in order, under the sheet's lease lock, and then pulls the
+      sheet whenever its revision changed (edits made directly in the spreadsheet, the summarization
+      service, other app instances). A pull never overwrites a copy that still has unpushed operations.
+    - Conflicts are last-writer-wins at push time: a pushed update overwrites the cells it names, and an
+      update of a row deleted in the sheet is dropped (the delete wins).
+    - Inserts are delivered at least once: a crash between the append and the outbox cleanup repeats it.
+    """
+
+    name = "replica"
+
+    # * Rows of user_chats are keyed by their document, so chat deletes apply per document
+    key_columns = {
+        "user_docs": "_fileId",
+        "user_tags": "_tagId",
+        "user_chats": "_fileId",
+        "user_info": "_userId"
+    }
+    push_interval = 2.0       # seconds between outbox pushes
+    pull_interval = 30.0      # seconds between revision checks of a spreadsheet
+    max_backoff   = 60.0      # seconds; retry delay cap when the sheet keeps failing
+
+    def __init__(self, db_dir = "./.easyessay/replica"):
+        self.db_dir     = db_dir
+        self.local      = SQLiteBackend(db_dir)
+        self.remote     = GoogleSheetBackend()
+        self._tables    = {}                    # sheet_id -> worksheets replicated by this process
+        self._pulled    = {}                    # sheet_id -> sheet revision of the last pull
+        self._pulled_at = {}
+        self._retry_at  = {}                    # sheet_id -> (time, delay) after a failed sync
+        self._outboxes  = set()
+        self._lock      = threading.RLock()
+        self._sync_lock = threading.Lock()      # one push / pull at a time
+        self._wakeup    = threading.Event()
+        self._worker    = None
+
+    # --- Local copy
+
+    def _connect(self, sheet_id):
+        conn = self.local._connect(sheet_id)
+        if sheet_id not in self._outboxes:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS "_outbox" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "op" TEXT)')
+            self._outboxes.add(sheet_id)
+        return conn
+
+    def _enqueue(self, conn, op):
+        conn.execute('INSERT INTO "_outbox" ("op") VALUES (?)', (json.dumps(op, ensure_ascii = False),))
+
+    def _keys(self, conn, worksheet, row_idxs):
+        """:return: {row_idx: primary key} of the local rows at these DataFrame indices."""
+        key_column = self.key_columns[worksheet]
+        rowids = [r[0] for r in conn.execute(f'SELECT rowid FROM "{worksheet}" ORDER BY rowid')]
+        return {
+            int(idx): conn.execute(f'SELECT "{key_column}" FROM "{worksheet}" WHERE rowid = ?', (rowids[int(idx)],)).fetchone()[0]
+            for idx in row_idxs if 0 <= int(idx) < len(rowids)
+        }
+
+    def _ensure(self, sheet_id, worksheet):
+        """Start replicating a worksheet (a partition: its whole table); the first time ever, wait for a copy of it."""
+        worksheet = SheetManager.table_of(worksheet)
+        self._start()
+        with self._lock:
+            if worksheet in self._tables.get(sheet_id, set()):
+                return
+            conn = self._connect(sheet_id)
+            try:
+                pulled = conn.execute('SELECT 1 FROM "_meta" WHERE "key" = ?', (f"pulled:{worksheet}",)).fetchone()
+            finally:
+                conn.close()
+            if pulled or self._pull(sheet_id, [worksheet]):
+                self._tables.setdefault(sheet_id, set()).add(worksheet)
+
+    # --- StorageBackend
+
+    def setup_schema(self, sheet_id):
+        self.local.setup_schema(sheet_id)
+        return self.remote.setup_schema(sheet_id)
+
+    def fetch(self, sheet_id, worksheet, incremental = False, columns = None, rows = None, cache = True):
+        self._ensure(sheet_id, worksheet)
+        return self.local.fetch(sheet_id, worksheet, columns = columns, rows = rows)
+
+    def fetch_cells(self, sheet_id, worksheet, row_idxs, columns):
+        self._ensure(sheet_id, worksheet)
+        return self.local.fetch_cells(sheet_id, worksheet, row_idxs, columns)
+
+    def insert(self, sheet_id, worksheet, row: list):
+        self.insert_rows(sheet_id, worksheet, [row])
+
+    def insert_rows(self, sheet_id, worksheet, rows: list[list]):
+        self._ensure(sheet_id, worksheet)
+        rows = [[str(v) for v in row] for row in rows]
+        conn = self._connect(sheet_id)
+        try:
+            with conn:
+                self.local._insert_rows(conn, worksheet, rows)
+                self._enqueue(conn, {"type": "insert", "worksheet": worksheet, "rows": rows})
+        finally:
+            conn.close()
+        self._wakeup.set()
+
+    def update(self, sheet_id, worksheet_name, row_idxs = None, column = None, values = None, cells = None):
+        self._ensure(sheet_id, worksheet_name)
+        if cells is None:
+            cells = [(idx, column, value) for idx, value in zip(row_idxs, values)]
+        conn = self._connect(sheet_id)
+        try:
+            with conn:
+                keys = self._keys(conn, worksheet_name, [idx for idx, _, _ in cells])
+                results = self.local._update(conn, worksheet_name, cells)
+                changes = {}
+                for idx, col, value in cells:
+                    if int(idx) in keys:
+                        changes.setdefault(keys[int(idx)], {})[col] = str(value)
+                if changes:
+                    self._enqueue(conn, {"type": "update", "worksheet": worksheet_name,
+                                         "key_column": self.key_columns[worksheet_name], "changes": changes})
+        finally:
+            conn.close()
+        self._wakeup.set()
+        return results
+
+    def delete_row(self, sheet_id, worksheet_name, row_idxs: list):
+        self._ensure(sheet_id, worksheet_name)
+        conn = self._connect(sheet_id)
+        try:
+            with conn:
+                keys = sorted(set(self._keys(conn, worksheet_name, row_idxs).values()))
+                self.local._delete_rows(conn, worksheet_name, row_idxs)
+                if keys:
+                    self._enqueue(conn, {"type": "delete", "worksheet": worksheet_name,
+                                         "key_column": self.key_columns[worksheet_name], "keys": keys})
+        finally:
+            conn.close()
+        self._wakeup.set()
+        return True
+
+    def delete_partitions(self, sheet_id, table, keys):
+        self._ensure(sheet_id, table)
+        keys = sorted(str(key) for key in keys)
+        conn = self._connect(sheet_id)
+        try:
+            with conn:
+                self.local._delete_partitions(conn, table, keys)
+                self._enqueue(conn, {"type": "drop", "worksheet": table, "keys": keys})
+        finally:
+            conn.close()
+        self._wakeup.set()
+        return True
+
+    def acquire_lock(self, sheet_id, worksheet_name, timeout = 10):
+        # * sessions of this process coordinate on the local copy; the worker takes the sheet's lock when pushing
+        return self.local.acquire_lock(sheet_id, worksheet_name, timeout)
+
+    def release_lock(self, sheet_id, worksheet_name):
+        return self.local.release_lock(sheet_id, worksheet_name)
+
+    def revision(self, sheet_id):
+        return self.local.revision(sheet_id)
+
+    def pending(self, sheet_id):
+        """Number of operations not yet pushed to the sheet."""
+        conn = self._connect(sheet_id)
+        try:
+            return conn.execute('SELECT COUNT(*) FROM "_outbox"').fetchone()[0]
+        finally:
+            conn.close()
+
+    # --- Sync worker
+
+    def _start(self):
+        with self._lock:
+            if self._worker is not None:
+                return
+            # * outboxes left by a previous run are pushed as well
+            for file in os.listdir(self.db_dir):
+                if file.endswith(".sqlite3"):
+                    self._tables.setdefault(file[:-len(".sqlite3")], set())
+            self._worker = threading.Thread(target = self._run, name = "replica-sync", daemon = True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(timeout = self.push_interval)
+            self._wakeup.clear()
+            with self._lock:
+                sheet_ids = list(self._tables)
+            with QuotaManager.priority(QuotaManager.BACKGROUND):
+                for sheet_id in sheet_ids:
+                    retry_time, delay = self._retry_at.get(sheet_id, (0.0, 0.0))
+                    if time.time() < retry_time:
+                        continue
+                    try:
+                        synced = self._push(sheet_id)
+                        if synced and time.time() - self._pulled_at.get(sheet_id, 0.0) >= self.pull_interval:
+                            with self._lock:
+                                worksheets = sorted(self._tables.get(sheet_id, set()))
+                            synced = not worksheets or self._pull(sheet_id, worksheets)
+                    except Exception:
+                        synced = False
+                    if synced:
+                        self._retry_at.pop(sheet_id, None)
+                    else:
+                        delay = min(max(delay * 2, self.push_interval), self.max_backoff)
+                        self._retry_at[sheet_id] = (time.time() + delay, delay)
+
+    def _push(self, sheet_id):
+        """Apply the outbox to the sheet in order; :return: True if it is empty afterwards."""
+        with self._sync_lock:
+            conn = self._connect(sheet_id)
+            try:
+                ops = [(op_id, json.loads(op)) for op_id, op in conn.execute('SELECT "id", "op" FROM "_outbox" ORDER BY "id"')]
+                i = 0
+                while i < len(ops):
+                    op_ids, op = [ops[i][0]], ops[i][1]
+                    if op["type"] == "insert":
+                        rows = list(op["rows"])
+                        # * consecutive appends to one worksheet go out in a single request
+                        while i + 1 < len(ops) and ops[i + 1][1]["type"] == "insert" and ops[i + 1][1]["worksheet"] == op["worksheet"]:
+                            i += 1
+                            op_ids.append(ops[i][0])
+                            rows.extend(ops[i][1]["rows"])
+                        self.remote.insert_rows(sheet_id, op["worksheet"], rows)
+                    elif op["type"] == "drop":
+                        if not self.remote.delete_partitions(sheet_id, op["worksheet"], op["keys"]):
+                            return False
+                    elif not self._apply_keyed(sheet_id, op):
+                        return False
+                    with conn:
+                        conn.executemany('DELETE FROM "_outbox" WHERE "id" = ?', [(op_id,) for op_id in op_ids])
+                    i += 1
+                return True
+            finally:
+                conn.close()
+
+    def _apply_keyed(self, sheet_id, op):
+        worksheet = op["worksheet"]
+        if not self.remote.acquire_lock(sheet_id, worksheet):
+            return False
+        try:
+            if op["type"] == "delete":
+                return IndexManager.delete_by_key(sheet_id, worksheet, op["key_column"], op["keys"], backend = self.remote)
+            found = IndexManager.locate(sheet_id, worksheet, op["key_column"], list(op["changes"]), backend = self.remote)
+            cells = [(idx, column, value)
+                     for key, idxs in found.items()
+                     for idx in idxs
+                     for column, value in op["changes"][key].items()]
+            return not cells or len(self.remote.update(sheet_id, worksheet, cells = cells)) == len(cells)
+        finally:
+            self.remote.release_lock(sheet_id, worksheet)
+
+    def _pull(self, sheet_id, worksheets):
+        """
+        Replace the local copy of `worksheets` with the sheet, unless operations are still waiting to be pushed.
+        :return: True if the copy is up to date with the sheet.
+        """
+        with self._sync_lock:
+            revision = self.remote.revision(sheet_id)
+            pulled = self._tables.get(sheet_id, set())
+            if revision is not None and revision == self._pulled.get(sheet_id) and set(worksheets) <= pulled:
+                self._pulled_at[sheet_id] = time.time()
+                return True
+
+            frames = {}
+            for worksheet in worksheets:
+                frame = self.remote.fetch(sheet_id, worksheet)
+                if frame is None or len(frame.columns) == 0:
+                    return False
+                headers = self.local.tables[worksheet]
+                frames[worksheet] = frame.reindex(columns = headers, fill_value = "").astype(str).values.tolist()
+
+            conn = self._connect(sheet_id)
+            try:
+                with conn:
+                    if conn.execute('SELECT COUNT(*) FROM "_outbox"').fetchone()[0]:
+                        return False       # * local edits first; the next pull picks up the rest
+                    for worksheet, rows in frames.items():
+                        headers = self.local.tables[worksheet]
+                        select = ", ".join(f'"{h}"' for h in headers)
+                        current = [list(r) for r in conn.execute(f'SELECT {select} FROM "{worksheet}" ORDER BY rowid')]
+                        # * identical tables keep the local revision, so sessions do not reload them
+                        if current != rows:
+                            conn.execute(f'DELETE FROM "{worksheet}"')
+                            self.local._insert_rows(conn, worksheet, rows)
+                        conn.execute('INSERT OR REPLACE INTO "_meta" ("key", "value") VALUES (?, 1)', (f"pulled:{worksheet}",))
+            finally:
+                conn.close()
+
+            self._pulled[sheet_id] = revision
+            self._pulled_at[sheet_id] = time.time()
+            return True
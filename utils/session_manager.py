@@ -0,0 +1,64 @@
+import streamlit as st
+import pandas as pd
+from utils.snapshot_manager import SnapshotManager
+
+
+class SessionManager:
+    """
+    Keeps the session's copies of the tables (see BootstrapManager) in step with the session's own writes.
+    A successful mutation patches the rows it changed, in its table and in the tables that depend on it
+    (deleting a tag re-tags its documents, deleting a document drops its chat history), so adding a tag no
+    longer reloads every document. `invalidate` reloads only the given tables, for writes whose rows the
+    session cannot reproduce, e.g. documents that the summarization service appends later.
+
+    After any of these, the session no longer matches a database revision: the Refresh button reloads,
+    and the on-disk snapshot is dropped.
+    """
+
+    @staticmethod
+    def _changed():
+        st.session_state.pop("bootstrap_revision", None)
+        if "sheet_id" in st.session_state:
+            SnapshotManager.drop(st.session_state["sheet_id"])
+
+    @staticmethod
+    def invalidate(*tables):
+        """Reload `tables` on the next run; what was built from them (messages) follows them on reload."""
+        for table in tables:
+            st.session_state.pop(table, None)
+        SessionManager._changed()
+
+    @staticmethod
+    def tag_added(tag_id, tag):
+        tags = st.session_state["user_tags"]
+        st.session_state["user_tags"] = pd.concat([tags, pd.DataFrame([{"_tagId": tag_id, "_tag": tag}])], ignore_index = True)
+        SessionManager._changed()
+
+    @staticmethod
+    def tags_deleted(tag_ids):
+        """Drop tags; their documents fall back to "default", as in the database."""
+        tags = st.session_state["user_tags"]
+        deleted = tags[tags["_tagId"].isin(tag_ids)]["_tag"].tolist()
+        st.session_state["user_tags"] = tags[~tags["_tagId"].isin(tag_ids)].reset_index(drop = True)
+        docs = st.session_state["user_docs"].copy()
+        docs.loc[docs["_tag"].isin(deleted), "_tag"] = "default"
+        st.session_state["user_docs"] = docs
+        SessionManager._changed()
+
+    @staticmethod
+    def docs_retagged(changes: dict):
+        """:param changes: {_fileId: new tag}"""
+        docs = st.session_state["user_docs"].copy()
+        docs["_tag"] = [changes.get(file_id, tag) for file_id, tag in zip(docs["_fileId"], docs["_tag"])]
+        st.session_state["user_docs"] = docs
+        SessionManager._changed()
+
+    @staticmethod
+    def docs_deleted(file_ids):
+        """Drop documents together with their chat history."""
+        docs = st.session_state["user_docs"]
+        st.session_state["user_docs"] = docs[~docs["_fileId"].isin(file_ids)].reset_index(drop = True)
+        if "user_chats" in st.session_state:
+            chats = st.session_state["user_chats"]
+            st.session_state["user_chats"] = chats[~chats["_fileId"].isin(file_ids)].reset_index(drop = True)
+        SessionManager._changed()
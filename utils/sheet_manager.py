@@ -5,34 +5,257 @@ import streamlit as st
 import pandas as pd
 import time
 import json
+import random
+import re
+import threading
+import uuid
+from utils.cache_manager import LRUCache, TTLCache
+from utils.lock_manager import LockManager
+from utils.quota_manager import QuotaManager
 
 class SheetManager:
 
+    # * One authorized client per process, shared by every session
+    _client            = None
+    _client_created_at = 0.0
+    _client_lock       = threading.Lock()
+    client_max_age     = 45 * 60      # seconds; rebuild before the service account token (1 hr) goes stale
+
+    # * Spreadsheet keys as they appear in ".../d/<key>/edit" links
+    sheet_id_pattern = re.compile(r"[A-Za-z0-9_-]+")
+
+    # * Spreadsheet / Worksheet handles keyed by sheet_id and (sheet_id, worksheet)
+    _handles = LRUCache(maxsize = 256)
+
+    # * Last frame of worksheets read incrementally (user_info), for tail fetches; dropped by update / delete_row
+    _tails = LRUCache(maxsize = 128)
+
+    # * Frames of recent fetches keyed by (sheet_id, worksheet, columns, rows), shared by every session;
+    # * writes through SheetManager invalidate the sheet's entries, writes from elsewhere show up after read_ttl
+    read_ttl = 30      # seconds
+    _reads = TTLCache(maxsize = 256, ttl = read_ttl)
+    # * Invalidations per (sheet_id, worksheet) and per (sheet_id, None) for the whole sheet: a fetch that
+    # * started before an invalidation must not store its (older) frame afterwards (see `_store`)
+    _generations      = {}
+    _generations_lock = threading.RLock()
+
+    # * Last Drive modifiedTime seen per spreadsheet (see `revision`)
+    _modified      = {}
+    _modified_lock = threading.Lock()
+
+    # * Lock queue of each worksheet: a "_lock_<worksheet>" worksheet of claim rows (see acquire_lock)
+    lock_prefix        = "_lock_"
+    lock_headers       = ["_owner", "_expiry", "_claim"]
+    lock_compact_after = 50       # dead rows ahead of the holder's claim before the holder deletes them
+
+    # * Tables stored as one worksheet per key value, e.g. the chats of document X in "chats_X", so that
+    # * reading or deleting one conversation only touches its own worksheet. Partitions have the layout of
+    # * their table, are created by their first append, and appends to the table are routed by key.
+    partitions = {
+        "user_chats": {"prefix": "chats_", "key": "_fileId"}
+    }
+    _partitioned = set()     # * (sheet_id, table) whose pre-partitioning worksheet was migrated (or never existed)
+
+    # * Column letter of each field, by worksheet
+    column_maps = {
+        "user_docs": {
+            "_fileId": "A",
+            "_fileName": "B", 
+            "_summary": "C",
+            "_generatedTime": "D",
+            "_length": "E",
+            "_tag": "F"  
+        },
+        "user_tags": {
+            "_tagId": "A",
+            "_tag": "B" 
+        },
+        "user_chats": {
+            "_fileId": "A",
+            "_role": "B",
+            "_content": "C",
+            "_model": "D",
+            "_time": "E"
+        },
+        "user_info": {
+            "_username": "A",
+            "_userId": "B",
+            "_email": "C",
+            "_password": "D",
+            "_registerTime": "E",
+            "_dbURL": "F"
+        }
+    }
+
+    @staticmethod
+    def table_of(worksheet):
+        """Table whose layout a worksheet has: e.g. "user_chats" for "chats_<_fileId>", else the worksheet itself."""
+        for table, config in SheetManager.partitions.items():
+            if worksheet.startswith(config["prefix"]):
+                return table
+        return worksheet
+
+    @staticmethod
+    def partition_name(table, key):
+        return SheetManager.partitions[table]["prefix"] + str(key)
+
     @staticmethod
     def authenticate_google_sheets():
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(st.secrets['gsheet-conn']['credits']), scope)
-        client = gspread.authorize(creds)
-        return client
-    
+        with SheetManager._client_lock:
+            if (SheetManager._client is None or
+                time.time() - SheetManager._client_created_at > SheetManager.client_max_age):
+                scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+                creds = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(st.secrets['gsheet-conn']['credits']), scope)
+                SheetManager._client = gspread.authorize(creds)
+                SheetManager._client_created_at = time.time()
+                # * handles hold a reference to the old client, so drop them together
+                SheetManager._handles.clear()
+            return SheetManager._client
+
+    @staticmethod
+    def reset_client():
+        """Force re-authorization on the next call, e.g. after a 401 from the API."""
+        with SheetManager._client_lock:
+            SheetManager._client = None
+            SheetManager._handles.clear()
+
+    @staticmethod
+    def get_spreadsheet(sheet_id):
+        client = SheetManager.authenticate_google_sheets()
+        sheet = SheetManager._handles.get(sheet_id)
+        if sheet is None:
+            sheet = QuotaManager.execute(sheet_id, "read", client.open_by_key, sheet_id)
+            SheetManager._handles.set(sheet_id, sheet)
+        return sheet
+
+    @staticmethod
+    def get_worksheet(sheet_id, worksheet_name):
+        ws = SheetManager._handles.get((sheet_id, worksheet_name))
+        if ws is None:
+            ws = QuotaManager.execute(sheet_id, "read", SheetManager.get_spreadsheet(sheet_id).worksheet, worksheet_name)
+            SheetManager._handles.set((sheet_id, worksheet_name), ws)
+        return ws
+
+    @staticmethod
+    def drop_handles(sheet_id):
+        """Forget cached handles of a spreadsheet (after a failed call or a structural change)."""
+        SheetManager._handles.pop_where(lambda key: key == sheet_id or (isinstance(key, tuple) and key[0] == sheet_id))
+
+    @staticmethod
+    def invalidate(sheet_id, worksheet = None):
+        """
+        Drop cached reads of a spreadsheet after a write: all of them, or those of one worksheet together with
+        the table it is a partition of; invalidating a partitioned table also drops the reads of its partitions.
+        """
+        stale = None if worksheet is None else {worksheet, SheetManager.table_of(worksheet)}
+        with SheetManager._generations_lock:
+            for name in stale or [None]:
+                SheetManager._generations[(sheet_id, name)] = SheetManager._generations.get((sheet_id, name), 0) + 1
+            SheetManager._reads.pop_where(lambda key: key[0] == sheet_id and
+                                          (stale is None or key[1] in stale or SheetManager.table_of(key[1]) == worksheet))
+
+    @staticmethod
+    def _generation(sheet_id, worksheet):
+        """Token that changes whenever the cached reads of `worksheet` are invalidated."""
+        g = SheetManager._generations
+        with SheetManager._generations_lock:
+            return (g.get((sheet_id, None), 0), g.get((sheet_id, worksheet), 0),
+                    g.get((sheet_id, SheetManager.table_of(worksheet)), 0))
+
+    @staticmethod
+    def _store(key, generation, df):
+        """Cache a fetched frame, unless its worksheet was invalidated since the fetch began (`generation`)."""
+        with SheetManager._generations_lock:
+            if SheetManager._generation(key[0], key[1]) == generation:
+                SheetManager._reads.set(key, df)
+
+    @staticmethod
+    def revision(sheet_id):
+        """
+        Cheap change marker of a spreadsheet: its Drive modifiedTime (one small metadata call). It only
+        depends on the spreadsheet, so every process and restart sees the same revision. Drive may report a
+        write a little late; a revision taken before a load is then older than the data, so the worst case
+        is one extra reload. A session's own writes are handled by SessionManager.
+        A modifiedTime not seen before also drops the cached reads of the sheet, so fetches made after
+        this call are at least as new as the returned revision.
+        :return: an opaque string that changes whenever the spreadsheet does, or None if unknown.
+        """
+        try:
+            sheet = SheetManager.get_spreadsheet(sheet_id)
+            modified = QuotaManager.execute(sheet_id, "read", sheet.get_lastUpdateTime)
+        except Exception as e:
+            SheetManager._on_error(sheet_id, e)
+            return None
+        with SheetManager._modified_lock:
+            changed = SheetManager._modified.get(sheet_id) != modified
+            SheetManager._modified[sheet_id] = modified
+        if changed:
+            SheetManager.invalidate(sheet_id)
+        return str(modified)
+
+    @staticmethod
+    def _on_error(sheet_id, error):
+        """A failed call may mean a stale handle (sheet renamed / deleted) or an expired token."""
+        SheetManager.drop_handles(sheet_id)
+        if isinstance(error, gspread.exceptions.APIError) and error.response.status_code == 401:
+            SheetManager.reset_client()
+
     @staticmethod
     def extract_sheet_id(sheet_url):
+        # * sheet_id names cache entries and snapshot directories, so only Google's key alphabet is accepted
         try:
-            return sheet_url.split("/d/")[1].split("/")[0]
-        except IndexError:
+            sheet_id = sheet_url.split("/d/")[1].split("/")[0]
+        except (IndexError, AttributeError):
+            sheet_id = None
+        if sheet_id is None or not SheetManager.sheet_id_pattern.fullmatch(sheet_id):
             st.error("無效的試算表連結，請檢查 URL 格式。")
             return None
+        return sheet_id
         
     @staticmethod
-    def fetch(sheet_id, worksheet):
+    def fetch(sheet_id, worksheet, incremental = False, columns = None, rows = None, cache = True):
+        """
+        Download a worksheet as a DataFrame (first row as headers).
+        :param incremental: for worksheets that grow at the end (user_info, see UserDirectory). Reuse the
+                            frame cached by the previous incremental fetch and only read the rows after it.
+                            Rows deleted before the end are noticed; rows edited in place are not, unless the
+                            edit went through `update`. Ignored for partitioned tables.
+        :param columns: only download these columns (one batch_get range per column).
+        :param rows: slice of DataFrame indices to download, e.g. slice(0, 50); the returned frame keeps those indices.
+        Non-incremental results are served from the process-wide read cache for up to `read_ttl` seconds,
+        unless `cache` is False (the fresh result is still stored for other readers). An incremental fetch
+        with `cache` False reads the whole worksheet and starts its tail over.
+        A partitioned table (see `partitions`) is read as all of its partitions, and a partition that does
+        not exist yet reads as an empty frame.
+        """
         if sheet_id:
-            client = SheetManager.authenticate_google_sheets()
+            if worksheet in SheetManager.partitions:
+                return SheetManager._fetch_partitioned(sheet_id, worksheet)
+            key = (sheet_id, worksheet,
+                   None if columns is None else tuple(columns),
+                   None if rows is None else (rows.start, rows.stop))
+            if not incremental and cache:
+                cached = SheetManager._reads.get(key)
+                if cached is not None:
+                    return cached.copy()
+            generation = SheetManager._generation(sheet_id, worksheet)
             try:
-                sheet = client.open_by_key(sheet_id)
-                ws = sheet.worksheet(worksheet)
+                if SheetManager.table_of(worksheet) != worksheet:
+                    SheetManager.ensure_partitioned(sheet_id, SheetManager.table_of(worksheet))
+                if columns is not None or rows is not None:
+                    df = SheetManager._fetch_ranges(sheet_id, worksheet, columns, rows)
+                    SheetManager._store(key, generation, df)
+                    return df.copy()
+
+                if incremental and cache:
+                    df = SheetManager._fetch_tail(sheet_id, worksheet)
+                    if df is not None:
+                        return df
+
+                ws = SheetManager.get_worksheet(sheet_id, worksheet)
                 
                 # 手動獲取所有值
-                all_values = ws.get_all_values()
+                all_values = QuotaManager.execute(sheet_id, "read", ws.get_all_values)
                 
                 if not all_values:
                     st.write("No data found in worksheet")
@@ -46,145 +269,471 @@ class SheetManager:
                 
                 # 創建 DataFrame 並設置 columns
                 df = pd.DataFrame(data_rows, columns=headers)
+
+                if incremental:
+                    SheetManager._tails.set((sheet_id, worksheet), df)
+                else:
+                    SheetManager._store(key, generation, df)
+                return df.copy()
                 
-                return df
-                
+            except gspread.exceptions.WorksheetNotFound as e:
+                table = SheetManager.table_of(worksheet)
+                if table != worksheet:
+                    return pd.DataFrame(columns = list(SheetManager.column_maps[table]))     # * nothing written to it yet
+                SheetManager._on_error(sheet_id, e)
+                st.write(f"Connection Failed: {e}")
+                return pd.DataFrame()
             except Exception as e:
+                SheetManager._on_error(sheet_id, e)
                 st.write(f"Connection Failed: {e}")
                 return pd.DataFrame()
 
+    @staticmethod
+    def ensure_partitioned(sheet_id, table):
+        """Migrate the pre-partitioning `table` worksheet, if any, before its partitions are read one by one (once per process)."""
+        if (sheet_id, table) not in SheetManager._partitioned:
+            SheetManager._partition_metadata(sheet_id, table)
+
+    @staticmethod
+    def _partition_metadata(sheet_id, table):
+        """
+        Spreadsheet metadata, after moving the rows of a `table` worksheet from before partitioning into partitions.
+        :return: (spreadsheet, {title: sheetId} of the partitions of `table`, in worksheet order)
+        """
+        sheet = SheetManager.get_spreadsheet(sheet_id)
+        metadata = QuotaManager.execute(sheet_id, "read", sheet.fetch_sheet_metadata)
+        if any(s["properties"]["title"] == table for s in metadata.get("sheets", [])):
+            SheetManager.migrate_partitions(sheet_id, table, metadata)
+            metadata = QuotaManager.execute(sheet_id, "read", sheet.fetch_sheet_metadata)
+        SheetManager._partitioned.add((sheet_id, table))
+        partitions = {
+            s["properties"]["title"]: s["properties"]["sheetId"]
+            for s in sorted(metadata.get("sheets", []), key = lambda s: s["properties"].get("index", 0))
+            if SheetManager.table_of(s["properties"]["title"]) == table and s["properties"]["title"] != table
+        }
+        return sheet, partitions
+
+    @staticmethod
+    def _fetch_partitioned(sheet_id, table, batch_size = 100):
+        """All partitions of `table` in one frame: one metadata read plus one values.batchGet per `batch_size` partitions."""
+        key = (sheet_id, table, None, None)
+        cached = SheetManager._reads.get(key)
+        if cached is not None:
+            return cached.copy()
+        generation = SheetManager._generation(sheet_id, table)
+
+        headers = list(SheetManager.column_maps[table])
+        rows = []
+        try:
+            sheet, partitions = SheetManager._partition_metadata(sheet_id, table)
+            titles = list(partitions)
+            for i in range(0, len(titles), batch_size):
+                ranges = ["'" + title.replace("'", "''") + "'" for title in titles[i:i + batch_size]]
+                response = QuotaManager.execute(sheet_id, "read", sheet.values_batch_get, ranges)
+                for value_range in response.get("valueRanges", []):
+                    rows.extend((list(r) + [""] * len(headers))[:len(headers)] for r in value_range.get("values", [])[1:])
+        except Exception as e:
+            SheetManager._on_error(sheet_id, e)
+            st.write(f"Connection Failed: {e}")
+            return pd.DataFrame()
+
+        df = pd.DataFrame(rows, columns = headers)
+        SheetManager._store(key, generation, df)
+        return df.copy()
+
+    @staticmethod
+    def _cell_rows(rows):
+        """Rows as RowData of an updateCells request (stored as text, like a RAW append)."""
+        return [{"values": [{"userEnteredValue": {"stringValue": str(v)}} for v in row]} for row in rows]
+
+    @staticmethod
+    def partition_requests(sheet_gid, worksheet, rows):
+        """Requests that create a partition worksheet holding the header row and `rows`, with a grid of exactly that size."""
+        headers = list(SheetManager.column_maps[SheetManager.table_of(worksheet)])
+        return [
+            {"addSheet": {"properties": {
+                "sheetId": sheet_gid,
+                "title": worksheet,
+                "gridProperties": {"rowCount": len(rows) + 1, "columnCount": len(headers)}
+            }}},
+            {"updateCells": {
+                "start": {"sheetId": sheet_gid, "rowIndex": 0, "columnIndex": 0},
+                "rows": SheetManager._cell_rows([headers] + [list(r) for r in rows]),
+                "fields": "userEnteredValue"
+            }}
+        ]
+
+    @staticmethod
+    def migrate_partitions(sheet_id, table, metadata):
+        """
+        Move the rows of the single `table` worksheet (the layout before partitioning) into partitions and delete
+        it, in one spreadsheets.batchUpdate. The batch applies fully or not at all, so a process migrating at the
+        same time cannot duplicate rows. Moved rows go before the rows a partition already has (newer ones).
+        :param metadata: result of Spreadsheet.fetch_sheet_metadata().
+        :return: number of rows moved.
+        """
+        config = SheetManager.partitions[table]
+        headers = list(SheetManager.column_maps[table])
+        existing = {s["properties"]["title"]: s["properties"]["sheetId"] for s in metadata.get("sheets", [])}
+
+        values = QuotaManager.execute(sheet_id, "read", SheetManager.get_worksheet(sheet_id, table).get_all_values)
+        groups = {}
+        for row in values[1:]:
+            row = (list(row) + [""] * len(headers))[:len(headers)]
+            if row[headers.index(config["key"])]:
+                groups.setdefault(SheetManager.partition_name(table, row[headers.index(config["key"])]), []).append(row)
+
+        requests, next_id = [], max(existing.values(), default = 0) + 1
+        for worksheet, rows in groups.items():
+            if worksheet in existing:
+                requests.append({"insertDimension": {"range": {"sheetId": existing[worksheet], "dimension": "ROWS",
+                                                               "startIndex": 1, "endIndex": 1 + len(rows)}}})
+                requests.append({"updateCells": {"start": {"sheetId": existing[worksheet], "rowIndex": 1, "columnIndex": 0},
+                                                 "rows": SheetManager._cell_rows(rows), "fields": "userEnteredValue"}})
+            else:
+                requests.extend(SheetManager.partition_requests(next_id, worksheet, rows))
+                next_id += 1
+        requests.append({"deleteSheet": {"sheetId": existing[table]}})
+
+        try:
+            QuotaManager.execute(sheet_id, "write", SheetManager.get_spreadsheet(sheet_id).batch_update, {"requests": requests})
+        finally:
+            SheetManager.drop_handles(sheet_id)
+            SheetManager.invalidate(sheet_id)
+        return sum(len(rows) for rows in groups.values())
+
+    @staticmethod
+    def _fetch_ranges(sheet_id, worksheet, columns = None, rows = None):
+        """Column-projected / row-limited read in a single batch_get."""
+        mapping = SheetManager.column_maps[SheetManager.table_of(worksheet)]
+        columns = list(mapping) if columns is None else list(columns)
+        start = (rows.start or 0) if rows is not None else 0
+        stop = rows.stop if rows is not None else None
+        first_row = start + 2                                   # * DataFrame index i lives in sheet row i + 2
+        last_row = "" if stop is None else stop + 1
+
+        ws = SheetManager.get_worksheet(sheet_id, worksheet)
+        value_ranges = QuotaManager.execute(sheet_id, "read", ws.batch_get,
+                                            [f"{mapping[col]}{first_row}:{mapping[col]}{last_row}" for col in columns])
+
+        # * each column comes back with its trailing empty cells trimmed, so pad to the longest one
+        n = max((len(vr) for vr in value_ranges), default = 0)
+        data = {
+            col: [(vr[i][0] if i < len(vr) and vr[i] else "") for i in range(n)]
+            for col, vr in zip(columns, value_ranges)
+        }
+        return pd.DataFrame(data, columns = columns, index = range(start, start + n))
+
+    @staticmethod
+    def fetch_cells(sheet_id, worksheet, row_idxs, columns):
+        """
+        Read a few cells by DataFrame index in one batch_get.
+        :return: {row_idx: {column: value}}
+        """
+        mapping = SheetManager.column_maps[SheetManager.table_of(worksheet)]
+        ranges = [(idx, col, f"{mapping[col]}{int(idx) + 2}") for idx in row_idxs for col in columns]
+        if not ranges:
+            return {}
+        try:
+            ws = SheetManager.get_worksheet(sheet_id, worksheet)
+            value_ranges = QuotaManager.execute(sheet_id, "read", ws.batch_get, [r for _, _, r in ranges])
+        except Exception as e:
+            SheetManager._on_error(sheet_id, e)
+            st.write(f"Connection Failed: {e}")
+            return {}
+        result = {}
+        for (idx, col, _), vr in zip(ranges, value_ranges):
+            result.setdefault(idx, {})[col] = vr[0][0] if vr and vr[0] else ""
+        return result
+
+    @staticmethod
+    def _fetch_tail(sheet_id, worksheet):
+        """
+        Read only the rows appended since the cached frame, re-reading its last row as a check.
+        :return: the merged DataFrame, or None when a full fetch is needed
+                 (nothing cached, or rows were deleted / rewritten in the meantime).
+        """
+        cached = SheetManager._tails.get((sheet_id, worksheet))
+        if cached is None or len(cached.columns) == 0:
+            return None
+
+        n = len(cached)                                 # * DataFrame index i lives in sheet row i + 2
+        first_row = n + 1 if n else 2
+        last_col = gspread.utils.rowcol_to_a1(1, len(cached.columns)).rstrip("0123456789")
+        ws = SheetManager.get_worksheet(sheet_id, worksheet)
+        values = QuotaManager.execute(sheet_id, "read", ws.get, f"A{first_row}:{last_col}")
+        rows = [list(r) + [""] * (len(cached.columns) - len(r)) for r in values]
+
+        if n:
+            if not rows or rows[0] != cached.iloc[-1].tolist():
+                SheetManager._tails.pop((sheet_id, worksheet))
+                return None
+            rows = rows[1:]
+
+        if rows:
+            cached = pd.concat([cached, pd.DataFrame(rows, columns = cached.columns)], ignore_index = True)
+            SheetManager._tails.set((sheet_id, worksheet), cached)
+        return cached.copy()
+
     @staticmethod
     def insert(sheet_id, worksheet, row: list):
         if sheet_id:
-            client = SheetManager.authenticate_google_sheets()
             try:
-                sheet = client.open_by_key(sheet_id)
-                worksheet = sheet.worksheet(worksheet)
-                worksheet.freeze(rows = 1)
-                worksheet.append_row(row)
-
-                records = worksheet.get_all_records()
+                SheetManager.append_rows(sheet_id, worksheet, [row])
                 
             except Exception as e:
-                st.write(f"Connection Failed: {e}")
+                st.error(f"Failed to save to the database: {e}")
 
     @staticmethod
-    def update(sheet_id, worksheet_name, row_idxs, column, values):
-        mapping = {
-            "user_docs": {
-                "_fileId": "A",
-                "_fileName": "B", 
-                "_summary": "C",
-                "_generatedTime": "D",
-                "_length": "E",
-                "_tag": "F"  
-            },
-            "user_tags": {
-                "_tagId": "A",
-                "_tag": "B" 
-            },
-            "user_info": {
-                "_dbURL": "F"
-            }
-        }
-        if sheet_id:
-            client = SheetManager.authenticate_google_sheets()
-            for idx, value in zip(row_idxs, values):
-                try:
-                    sheet = client.open_by_key(sheet_id)
-                    worksheet = sheet.worksheet(worksheet_name)
-                    pos = f"{mapping[worksheet_name][column]}{idx + 2}"
-                    worksheet.update_acell(pos, value)
-                    
-                except Exception as e:
-                    st.write(f"Connection Failed: {e}")
+    def append_rows(sheet_id, worksheet, rows: list[list]):
+        """
+        Append many rows in one values.append request (one per partition for a partitioned table,
+        see `partitions`). Raises on failure so that callers running outside of a Streamlit script
+        (e.g. the write-behind queue) can retry.
+        """
+        try:
+            if worksheet in SheetManager.partitions:
+                key_idx = list(SheetManager.column_maps[worksheet]).index(SheetManager.partitions[worksheet]["key"])
+                groups = {}
+                for row in rows:
+                    groups.setdefault(SheetManager.partition_name(worksheet, row[key_idx]), []).append(row)
+                for partition, partition_rows in groups.items():
+                    SheetManager._append_partition(sheet_id, partition, partition_rows)
+            elif SheetManager.table_of(worksheet) != worksheet:
+                SheetManager._append_partition(sheet_id, worksheet, rows)
+            else:
+                ws = SheetManager.get_worksheet(sheet_id, worksheet)
+                QuotaManager.execute(sheet_id, "write", ws.append_rows, rows)
+        except Exception as e:
+            SheetManager._on_error(sheet_id, e)
+            raise
+        finally:
+            SheetManager.invalidate(sheet_id, worksheet)
 
     @staticmethod
-    def delete_row(sheet_id, worksheet_name, row_idxs: list):
+    def _append_partition(sheet_id, worksheet, rows):
+        """Append to a partition; its first rows create it, together with its header, in one request."""
+        try:
+            ws = SheetManager.get_worksheet(sheet_id, worksheet)
+        except gspread.exceptions.WorksheetNotFound:
+            sheet = SheetManager.get_spreadsheet(sheet_id)
+            try:
+                # * a random sheetId saves a metadata read; a clash only fails this request
+                QuotaManager.execute(sheet_id, "write", sheet.batch_update,
+                                     {"requests": SheetManager.partition_requests(random.randint(1, 2**31 - 1), worksheet, rows)})
+                return
+            except gspread.exceptions.APIError:
+                SheetManager.drop_handles(sheet_id)
+                ws = SheetManager.get_worksheet(sheet_id, worksheet)     # * created by another process meanwhile
+        QuotaManager.execute(sheet_id, "write", ws.append_rows, rows)
 
+    @staticmethod
+    def delete_partitions(sheet_id, table, keys):
+        """
+        Delete the partitions of `keys` (e.g. all chats of some documents) in one spreadsheets.batchUpdate,
+        whatever their size.
+        :return: True if they are gone (or never existed), False otherwise.
+        """
         if not sheet_id:
             st.write("No sheet_id provided!")
-            return
+            return False
+
+        worksheets = {SheetManager.partition_name(table, key) for key in keys}
+        try:
+            sheet, partitions = SheetManager._partition_metadata(sheet_id, table)
+            requests = [{"deleteSheet": {"sheetId": gid}} for title, gid in partitions.items() if title in worksheets]
+            if requests:
+                QuotaManager.execute(sheet_id, "write", sheet.batch_update, {"requests": requests})
+            return True
+        except Exception as e:
+            SheetManager._on_error(sheet_id, e)
+            st.write(f"Failed to delete: {e}")
+            return False
+        finally:
+            SheetManager.drop_handles(sheet_id)
+            SheetManager.invalidate(sheet_id)
+
+    @staticmethod
+    def update(sheet_id, worksheet_name, row_idxs = None, column = None, values = None, cells = None, chunk_size = 500):
+        """
+        Write cells in as few values.batchUpdate requests as possible.
+        :param row_idxs, column, values: one column, one value per DataFrame row index.
+        :param cells: (row_idx, column, value) triples; may mix columns. Used instead of the three above.
+        :param chunk_size: max number of ranges per request.
+        :return: list of per-range results, e.g. {"updatedRange": "user_docs!F3", "updatedCells": 1}.
+        """
+        if not sheet_id:
+            return []
         
-        while True:
-            try:
-                client = SheetManager.authenticate_google_sheets()
+        if cells is None:
+            cells = [(idx, column, value) for idx, value in zip(row_idxs, values)]
+        mapping = SheetManager.column_maps[SheetManager.table_of(worksheet_name)]
+        data = [
+            {"range": f"{mapping[col]}{idx + 2}", "values": [[value]]}
+            for idx, col, value in cells
+        ]
 
-                sheet = client.open_by_key(sheet_id)
-                worksheet = sheet.worksheet(worksheet_name)
+        results = []
+        try:
+            worksheet = SheetManager.get_worksheet(sheet_id, worksheet_name)
+            for i in range(0, len(data), chunk_size):
+                chunk = data[i:i + chunk_size]
+                # * batch_update prefixes each "range" with the sheet name in place, so every attempt sends a fresh copy
+                response = QuotaManager.execute(sheet_id, "write",
+                                                lambda: worksheet.batch_update([dict(d) for d in chunk], value_input_option = "USER_ENTERED"),
+                                                idempotent = True)
+                results.extend(response.get("responses", []))
+        except Exception as e:
+            SheetManager._on_error(sheet_id, e)
+            st.error(f"Failed to save to the database: {e}")
+        SheetManager._tails.pop((sheet_id, worksheet_name))     # * rows edited in place: the next tail fetch reads in full
+        SheetManager.invalidate(sheet_id, worksheet_name)
+        return results
 
-                if SheetManager.acquire_lock(sheet_id, worksheet_name):
-                    for idx in sorted(row_idxs, reverse = True):
-                        worksheet.delete_rows(idx + 2)
-                    break
-                else:
-                    pass
+    @staticmethod
+    def coalesce_ranges(row_idxs):
+        """
+        Merge DataFrame row indices into contiguous half-open ranges, last range first.
+        e.g. [5, 1, 2, 3, 9, 10] -> [(9, 11), (5, 6), (1, 4)]
+        """
+        ranges = []
+        for idx in sorted(set(int(i) for i in row_idxs)):
+            if ranges and idx == ranges[-1][1]:
+                ranges[-1][1] = idx + 1
+            else:
+                ranges.append([idx, idx + 1])
+        return [tuple(r) for r in reversed(ranges)]
 
+    @staticmethod
+    def delete_ranges(spreadsheet, worksheet, ranges, chunk_size = 500):
+        """
+        Delete row ranges with deleteDimension requests in one spreadsheets.batchUpdate per chunk.
+        Ranges must be ordered last-first so that earlier deletions do not shift later ones.
+        :return: number of API calls made.
+        """
+        requests = [
+            {"deleteDimension": {"range": {"sheetId": worksheet.id,
+                                           "dimension": "ROWS",
+                                           "startIndex": start + 1,     # DataFrame index 0 is grid row 1 (row 0 is the header)
+                                           "endIndex": end + 1}}}
+            for start, end in ranges
+        ]
+        calls = 0
+        for i in range(0, len(requests), chunk_size):
+            QuotaManager.execute(getattr(spreadsheet, "id", None), "write",
+                                 spreadsheet.batch_update, {"requests": requests[i:i + chunk_size]})
+            calls += 1
+        return calls
 
-            except Exception as e:
-                st.write(f"Failed to delete row: {e}")
-                break
+    @staticmethod
+    def delete_row(sheet_id, worksheet_name, row_idxs: list):
+        """
+        Delete rows by DataFrame index (sheet row = index + 2).
+        :return: True if the rows were deleted, False otherwise.
+        """
+        if not sheet_id:
+            st.write("No sheet_id provided!")
+            return False
+        
+        ranges = SheetManager.coalesce_ranges(row_idxs)
+        if not ranges:
+            return True
+
+        # * acquire_lock is already bounded by its own timeout; do not spin on it
+        if not SheetManager.acquire_lock(sheet_id, worksheet_name):
+            st.warning("The database is busy. Please try again later.")
+            return False
+
+        try:
+            worksheet = SheetManager.get_worksheet(sheet_id, worksheet_name)
+            SheetManager.delete_ranges(SheetManager.get_spreadsheet(sheet_id), worksheet, ranges)
+            SheetManager._tails.pop((sheet_id, worksheet_name))
+            return True
+        except Exception as e:
+            SheetManager._on_error(sheet_id, e)
+            st.write(f"Failed to delete row: {e}")
+            return False
+        finally:
+            SheetManager.invalidate(sheet_id, worksheet_name)
 
     @staticmethod
-    def acquire_lock(sheet_id, worksheet_name, timeout = 10):
-        lock_maps = {
-            "user_info": "G1",
-            "user_docs": "G1",
-            "user_tags": "C1",
-            "user_chats": "F1"
-        }
+    def _lock_worksheet(sheet_id, worksheet_name):
+        """The lock queue of a worksheet; created with its header in one request, so no claim can land in row 1."""
+        name = SheetManager.lock_prefix + worksheet_name
+        try:
+            return SheetManager.get_worksheet(sheet_id, name)
+        except gspread.exceptions.WorksheetNotFound:
+            sheet = SheetManager.get_spreadsheet(sheet_id)
+            sheet_gid = random.randint(1, 2**31 - 1)
+            try:
+                QuotaManager.execute(sheet_id, "write", sheet.batch_update, {"requests": [
+                    {"addSheet": {"properties": {"sheetId": sheet_gid, "title": name, "hidden": True,
+                                                 "gridProperties": {"rowCount": 1, "columnCount": len(SheetManager.lock_headers)}}}},
+                    {"updateCells": {"start": {"sheetId": sheet_gid, "rowIndex": 0, "columnIndex": 0},
+                                     "rows": SheetManager._cell_rows([SheetManager.lock_headers]), "fields": "userEnteredValue"}}
+                ]})
+            except gspread.exceptions.APIError:
+                pass        # * created by another process meanwhile
+            SheetManager.drop_handles(sheet_id)
+            return SheetManager.get_worksheet(sheet_id, name)
 
+    @staticmethod
+    def _append_claims(sheet_id, lock_ws, rows):
+        QuotaManager.execute(sheet_id, "write", lock_ws.append_rows, rows, value_input_option = "RAW",
+                             insert_data_option = "INSERT_ROWS", table_range = "A1")
+
+    @staticmethod
+    def acquire_lock(sheet_id, worksheet_name, timeout = 10):
         """
-        Acquire a lock before editing.
-        :param worksheet: The gspread worksheet object.
-        :param lock_pos: the position of the cell that stores the lock status
+        Acquire the lease lock of a worksheet before editing (also True if this session holds it already).
+        Sheets has no conditional write, but it applies the appends to a worksheet one after another: each
+        caller appends a claim row to the lock queue of the worksheet, and the earliest live claim holds the
+        lock (see LockManager.live_claims). A waiting claim keeps its place, so waiters are served in order.
         :param timeout: Max time (in seconds) to wait for lock.
         :return: True if lock acquired, False otherwise.
         """
+        me = LockManager.owner()
+        claim = uuid.uuid4().hex
         start_time = time.time()
-        client = SheetManager.authenticate_google_sheets()
-        sheet = client.open_by_key(sheet_id)
-        worksheet = sheet.worksheet(worksheet_name)
+        attempt = 0
+        lock_ws = SheetManager._lock_worksheet(sheet_id, worksheet_name)
+        # * the claim outlives the wait, so that it still holds for lease_ttl once granted
+        SheetManager._append_claims(sheet_id, lock_ws, [[me, f"{start_time + timeout + LockManager.lease_ttl:.0f}", claim]])
         with st.spinner("Waiting for lock..."):
-            while time.time() - start_time < timeout:
-                lock_status = worksheet.acell(lock_maps[worksheet_name]).value
+            while True:
+                attempt += 1
+                live = LockManager.live_claims(QuotaManager.execute(sheet_id, "read", lock_ws.get_all_values)[1:])
 
-                if lock_status == "Unlocked":
-                    # Acquire the lock
-                    worksheet.update_acell(lock_maps[worksheet_name], st.session_state["user_id"])
-                    
+                if live and live[0][1] == me:
+                    LockManager.record(worksheet_name, True, time.time() - start_time, attempt)
+                    position = live[0][0]
+                    if position >= SheetManager.lock_compact_after:
+                        # * every row ahead of the holder's claim is dead, and only the holder deletes rows
+                        SheetManager.delete_ranges(SheetManager.get_spreadsheet(sheet_id), lock_ws, [(0, position)])
                     return True
-                
-                elif lock_status == st.session_state["user_id"]:
-                    # Already locked by the same user
-                    return True
-                
-                time.sleep(0.5)
 
+                remaining = timeout - (time.time() - start_time)
+                if remaining <= 0:
+                    break
+                time.sleep(min(LockManager.backoff(attempt), remaining))
+
+        SheetManager._append_claims(sheet_id, lock_ws, [[LockManager.free_owner, "0", claim]])     # * leave the queue
+        LockManager.record(worksheet_name, False, time.time() - start_time, attempt)
         return False
     
     @staticmethod
     def release_lock(sheet_id, worksheet_name):
         """
-        Release the lock after editing.
-        :param worksheet: The gspread worksheet object.
-        :param user_email: The email of the user trying to release the lock.
+        Release the lease after editing, by appending a release row for each live claim of this session.
         :return: True if lock released, False otherwise.
         """
-        lock_maps = {
-            "user_info": "G1",
-            "user_docs": "G1",
-            "user_tags": "C1",
-            "user_chats": "F1"
-        }
-
-        client = SheetManager.authenticate_google_sheets()
-        sheet = client.open_by_key(sheet_id)
-        worksheet = sheet.worksheet(worksheet_name)
-        lock_status = worksheet.acell(lock_maps[worksheet_name]).value
+        me = LockManager.owner()
+        lock_ws = SheetManager._lock_worksheet(sheet_id, worksheet_name)
+        live = LockManager.live_claims(QuotaManager.execute(sheet_id, "read", lock_ws.get_all_values)[1:])
+        mine = [claim for _, owner, claim in live if owner == me]
 
-        if lock_status == st.session_state["user_id"]:
-            worksheet.update_acell(lock_maps[worksheet_name], "Unlocked")
+        if mine:
+            SheetManager._append_claims(sheet_id, lock_ws, [[LockManager.free_owner, "0", claim] for claim in mine])
             return True
         else:
             st.write("Lock is not held by you!")
@@ -195,141 +744,136 @@ class SheetManager:
 
 class GoogleSheetDB(SheetManager):
 
+    # * Database schema of a user's own spreadsheet
+    schema = {
+        "user_docs": {
+            "headers": ["_fileId", "_fileName", "_summary", "_generatedTime", "_length", "_tag"],
+            "description": "User documents table"
+        },
+        "user_tags": {
+            "headers": ["_tagId", "_tag"],
+            "description": "User tags table"
+        },
+        "user_chats": {
+            "headers": ["_fileId", "_role", "_content", "_model", "_time"],
+            "description": "User chat history table"
+        }
+    }
+
+    # * Schema of the central user table (lives in the spreadsheet of st.secrets['gsheet-urls']['user'])
+    user_info_schema = {
+        "user_info": {
+            "headers": ["_username", "_userId", "_email", "_password", "_registerTime", "_dbURL"],
+            "description": "Registered users table"
+        }
+    }
+
+    # * Worksheets that come with a new spreadsheet, removed once the schema worksheets exist
+    default_worksheet_names = ["Untitled spreadsheet", "Sheet1", "工作表1", "未命名的工作表"]
+
+    # * Header row format of every schema worksheet
+    header_format = {
+        "textFormat": {
+            "bold": True
+        },
+        "backgroundColor": {
+            "red": 0.9,
+            "green": 0.9,
+            "blue": 0.9
+        }
+    }
+
     @staticmethod
-    def delete_default_worksheet(sheet_id):
+    def schema_requests(metadata, schema, reset_existing = False, delete_default = True):
         """
-        Delete the default "Untitled spreadsheet" worksheet
-        
-        Args:
-            sheet_id (str): Google Sheet ID
+        Build the batch requests that bring a spreadsheet to `schema`. Safe to re-run: existing worksheets
+        are kept (unless reset). Locks live in their own `_lock_<worksheet>` sheets, created on first use.
+        :param metadata: result of Spreadsheet.fetch_sheet_metadata().
+        :return: (spreadsheets.batchUpdate requests, values.batchUpdate data, names of created worksheets)
         """
-        try:
-            client = GoogleSheetDB.authenticate_google_sheets()
-            sheet = client.open_by_key(sheet_id)
-            
-            # Get all worksheets
-            worksheets = sheet.worksheets()
-            
-            # Find default worksheet (usually the first one)
-            default_worksheet_names = ["Untitled spreadsheet", "Sheet1", "工作表1", "未命名的工作表"]
-            
-            for worksheet in worksheets:
-                if worksheet.title in default_worksheet_names:
-                    # Ensure it's not the only worksheet
-                    if len(worksheets) > 1:
-                        st.info(f"Deleting default worksheet: {worksheet.title}")
-                        sheet.del_worksheet(worksheet)
-                        st.success(f"✅ Deleted default worksheet: {worksheet.title}")
-                        return True
-                    else:
-                        st.warning("⚠️ Cannot delete the only worksheet, please create other worksheets first")
-                        return False
-            
-            st.info("ℹ️ No default worksheet found")
-            return True
-            
-        except Exception as e:
-            st.error(f"❌ Error deleting default worksheet: {str(e)}")
-            return False
+        existing = {s["properties"]["title"]: s["properties"]["sheetId"] for s in metadata.get("sheets", [])}
+        next_id = max(existing.values(), default = 0) + 1
+        requests, data, created = [], [], []
+
+        for worksheet_name, config in schema.items():
+            if worksheet_name in SheetManager.partitions:
+                continue        # * its worksheets are created by the first append to each partition
+            if worksheet_name in existing:
+                sheet_gid = existing[worksheet_name]
+                if reset_existing:
+                    requests.append({"updateCells": {"range": {"sheetId": sheet_gid}, "fields": "userEnteredValue"}})
+            else:
+                sheet_gid, next_id = next_id, next_id + 1
+                requests.append({"addSheet": {"properties": {
+                    "sheetId": sheet_gid,
+                    "title": worksheet_name,
+                    "gridProperties": {"rowCount": 1000, "columnCount": 20}
+                }}})
+                created.append(worksheet_name)
+
+            requests.append({"updateSheetProperties": {
+                "properties": {"sheetId": sheet_gid, "gridProperties": {"frozenRowCount": 1}},
+                "fields": "gridProperties.frozenRowCount"
+            }})
+            requests.append({"repeatCell": {
+                "range": {"sheetId": sheet_gid, "startRowIndex": 0, "endRowIndex": 1, "startColumnIndex": 0, "endColumnIndex": 26},
+                "cell": {"userEnteredFormat": GoogleSheetDB.header_format},
+                "fields": "userEnteredFormat(textFormat,backgroundColor)"
+            }})
+            data.append({"range": f"'{worksheet_name}'!A1", "values": [config["headers"]]})
+
+        if delete_default:
+            for title, sheet_gid in existing.items():
+                if title in GoogleSheetDB.default_worksheet_names and title not in schema:
+                    requests.append({"deleteSheet": {"sheetId": sheet_gid}})
+
+        return requests, data, created
 
     @staticmethod
     def setup_database_schema(sheet_id, reset_existing=False, delete_default=True):
         """
         Set up Google Sheet database schema
-        Create necessary worksheets and header rows
+        Create necessary worksheets, header rows, frozen rows and header format
+        with one spreadsheets.batchUpdate and one values.batchUpdate.
         
         Args:
             sheet_id (str): Google Sheet ID
             reset_existing (bool): Whether to reset existing worksheets
             delete_default (bool): Whether to delete default "Untitled spreadsheet"
         """
-        
-        # Define database schema
-        schema = {
-            "user_docs": {
-                "headers": ["_fileId", "_fileName", "_summary", "_generatedTime", "_length", "_tag"],
-                "lock_cell": "G1", 
-                "description": "User documents table"
-            },
-            "user_tags": {
-                "headers": ["_tagId", "_tag"],
-                "lock_cell": "C1",
-                "description": "User tags table"
-            },
-            "user_chats": {
-                "headers": ["_fileId", "_role", "_content", "_model", "_time"],
-                "lock_cell": "F1",
-                "description": "User chat history table"
-            }
-        }
+        schema = GoogleSheetDB.schema
         
         if not sheet_id:
             st.error("No sheet_id provided!")
             return False
         
         try:
-            client = GoogleSheetDB.authenticate_google_sheets()
-            sheet = client.open_by_key(sheet_id)
+            sheet = GoogleSheetDB.get_spreadsheet(sheet_id)
             
-            # Iterate through all worksheet schemas
             with st.status(f"Setting up Database"):
+                metadata = QuotaManager.execute(sheet_id, "read", sheet.fetch_sheet_metadata)
+                requests, data, created = GoogleSheetDB.schema_requests(metadata, schema, reset_existing, delete_default)
 
                 for worksheet_name, config in schema.items():
-                    try:
-                        st.write(f"Setting up worksheet: {worksheet_name} ({config['description']})")
-                        
-                        # Check if worksheet exists
-                        try:
-                            worksheet = sheet.worksheet(worksheet_name)
-                            if reset_existing:
-                                st.warning(f"Worksheet {worksheet_name} already exists, resetting...")
-                                worksheet.clear()
-                            else:
-                                st.info(f"Worksheet {worksheet_name} already exists, skipping creation")
-                                continue
-                        except gspread.WorksheetNotFound:
-                            st.info(f"Creating new worksheet: {worksheet_name}")
-                            worksheet = sheet.add_worksheet(
-                                title=worksheet_name,
-                                rows=1000,  # Default row count
-                                cols=20     # Default column count
-                            )
-                            
-                        
-                        # Set header row
-                        worksheet.update('A1', [config['headers']])
-                        
-                        # Freeze first row
-                        worksheet.freeze(rows=1)
-                        
-                        # Initialize lock status
-                        worksheet.update_acell(config['lock_cell'], "Unlocked")
-                        
-                        # Format header row (bold)
-                        worksheet.format('A1:Z1', {
-                            "textFormat": {
-                                "bold": True
-                            },
-                            "backgroundColor": {
-                                "red": 0.9,
-                                "green": 0.9,
-                                "blue": 0.9
-                            }
-                        })
-                            
-                        
-                    except Exception as e:
-                        st.error(f"❌ Error setting up worksheet {worksheet_name}: {str(e)}")
-                        continue
+                    if worksheet_name in GoogleSheetDB.partitions:
+                        status = "one worksheet per document, created on first use"
+                    else:
+                        status = "created" if worksheet_name in created else ("reset" if reset_existing else "already exists")
+                    st.write(f"{worksheet_name} ({config['description']}): {status}")
+
+                QuotaManager.execute(sheet_id, "write", sheet.batch_update, {"requests": requests})
+                QuotaManager.execute(sheet_id, "write", sheet.values_batch_update,
+                                     {"valueInputOption": "RAW", "data": data}, idempotent = True)
             
-            # Delete default worksheet (if needed)
-            if delete_default:
-                GoogleSheetDB.delete_default_worksheet(sheet_id)
+            # Worksheets were added / cleared / deleted, so cached handles and reads are stale
+            GoogleSheetDB.drop_handles(sheet_id)
+            GoogleSheetDB.invalidate(sheet_id)
             
             st.success("🎉 Database schema setup completed!")
             return True
             
         except Exception as e:
+            GoogleSheetDB.drop_handles(sheet_id)
             st.error(f"❌ Error setting up database schema: {str(e)}")
             return False
         
@@ -339,14 +883,12 @@ class GoogleSheetDB(SheetManager):
     def update_user_db_url():
         input_ = st.text_input("Input the google sheet link...")
         if st.button("Create Database Schema", width = "stretch"):
-            user_infos = (SheetManager
-                            .fetch(
-                                SheetManager
-                                .extract_sheet_id(st.secrets['gsheet-urls']['user']), "user_info"
-                                    ))
+            from utils.index_manager import IndexManager     # * both import this module (index_manager through storage_manager)
+            from utils.user_manager import UserDirectory
 
             # Verify whether the link exists already
-            if input_ in user_infos['_dbURL']:
+            UserDirectory.refresh(force = True)
+            if UserDirectory.lookup("_dbURL", input_) is not None:
                 st.warning("This URL is used. Please create a new empty google sheet, make it publicly editable, and paste the link here.")
             sheet_id = SheetManager.extract_sheet_id(input_)
             if sheet_id == None:
@@ -354,13 +896,13 @@ class GoogleSheetDB(SheetManager):
             else:
                 GoogleSheetDB.setup_database_schema(sheet_id)
 
-            # Update the link to meta database
-            SheetManager.update(
-                SheetManager.extract_sheet_id(st.secrets['gsheet-urls']['user']),
+            # Update the link to meta database (the row is located by _userId, checked against the sheet)
+            IndexManager.update_by_key(
+                UserDirectory.sheet_id(),
                 "user_info",
-                user_infos[user_infos["_userId"] == st.session_state["user_id"]].index,
-                column = "_dbURL",
-                values = [input_]
+                "_userId",
+                {st.session_state["user_id"]: {"_dbURL": input_}}
             )
+            UserDirectory.invalidate()
             st.session_state["_dbURL"] = input_
             st.rerun()
\ No newline at end of file
@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.ipc
+from utils.storage_manager import StorageManager
+
+
+class SnapshotManager:
+    """
+    On-disk copy of the tables a session bootstraps with, so that a reload or a new tab renders without
+    downloading them again. One directory per sheet_id holds an Arrow IPC file per table and `meta.json`
+    (format version, database revision, file of each table); meta.json is replaced last, so a reader
+    always sees one complete snapshot. Loading memory-maps the files.
+
+    A loaded snapshot is checked against the database revision in the background (`check`); when it is
+    outdated, `is_stale` tells the session to reload and the snapshot is dropped.
+    """
+
+    snapshot_dir = "./.easyessay/snapshots"
+    version      = 1           # * bump when the stored layout changes; older snapshots are ignored
+
+    _checks = {}               # * sheet_id -> (snapshot revision, database revision) of the last check
+    _lock   = threading.Lock()
+    _pool   = ThreadPoolExecutor(max_workers = 2, thread_name_prefix = "snapshot")
+
+    @staticmethod
+    def _dir(sheet_id):
+        """:return: the snapshot directory of `sheet_id`, or None unless it lies strictly inside snapshot_dir."""
+        root = os.path.realpath(SnapshotManager.snapshot_dir)
+        path = os.path.realpath(os.path.join(root, str(sheet_id)))
+        if not sheet_id or os.path.dirname(path) != root:
+            return None
+        return path
+
+    @staticmethod
+    def save(sheet_id, revision, frames: dict):
+        """Write `frames` ({table: DataFrame}) as the snapshot of `sheet_id` at `revision`."""
+        directory = SnapshotManager._dir(sheet_id)
+        if directory is None or revision is None:
+            return False
+        os.makedirs(directory, exist_ok = True)
+        tag = uuid.uuid4().hex[:12]
+        files = {}
+        for name, frame in frames.items():
+            files[name] = f"{name}-{tag}.arrow"
+            table = pa.Table.from_pandas(frame.astype(str), preserve_index = False)
+            with pa.OSFile(os.path.join(directory, files[name]), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+        meta = {"version": SnapshotManager.version, "revision": revision, "tables": files}
+        tmp_path = os.path.join(directory, f"meta-{tag}.json")
+        with open(tmp_path, "w", encoding = "utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(directory, "meta.json"))
+
+        # * files of older snapshots (readers that mapped them keep their open handles)
+        for file in os.listdir(directory):
+            if file.endswith(".arrow") and file not in files.values():
+                try:
+                    os.remove(os.path.join(directory, file))
+                except OSError:
+                    pass
+        return True
+
+    @staticmethod
+    def load(sheet_id, names):
+        """:return: (revision, {table: DataFrame}) if a complete snapshot of `names` exists, else None."""
+        directory = SnapshotManager._dir(sheet_id)
+        if directory is None:
+            return None
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding = "utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != SnapshotManager.version or any(name not in meta["tables"] for name in names):
+                return None
+            frames = {}
+            for name in names:
+                with pa.memory_map(os.path.join(directory, meta["tables"][name]), "r") as source:
+                    frames[name] = pa.ipc.open_file(source).read_all().to_pandas()
+            return meta["revision"], frames
+        except (OSError, ValueError, KeyError, pa.ArrowException):
+            return None
+
+    @staticmethod
+    def drop(sheet_id, revision = None):
+        """Delete the snapshot of `sheet_id` (only if it is still the one at `revision`, when given)."""
+        directory = SnapshotManager._dir(sheet_id)
+        if directory is None:
+            return
+        if revision is not None:
+            try:
+                with open(os.path.join(directory, "meta.json"), encoding = "utf-8") as f:
+                    if json.load(f).get("revision") != revision:
+                        return
+            except (OSError, ValueError):
+                return
+        shutil.rmtree(directory, ignore_errors = True)
+
+    @staticmethod
+    def check(sheet_id, revision):
+        """Compare a loaded snapshot with the database in the background; outdated snapshots are dropped."""
+        def task():
+            current = StorageManager.backend().revision(sheet_id)
+            with SnapshotManager._lock:
+                SnapshotManager._checks[sheet_id] = (revision, current)
+            if current is not None and current != revision:
+                SnapshotManager.drop(sheet_id, revision)
+        return SnapshotManager._pool.submit(task)
+
+    @staticmethod
+    def is_stale(sheet_id, revision):
+        """True once a background check found that the snapshot loaded at `revision` is outdated."""
+        with SnapshotManager._lock:
+            checked, current = SnapshotManager._checks.get(sheet_id, (None, None))
+        return checked == revision and current is not None and current != revision
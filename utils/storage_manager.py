@@ -0,0 +1,363 @@
+import streamlit as st
+import pandas as pd
+import sqlite3
+import threading
+import time
+import os
+import gspread
+from utils.sheet_manager import SheetManager, GoogleSheetDB
+from utils.lock_manager import LockManager
+
+
+class StorageBackend:
+    """
+    Storage interface used by the pages. Tables follow `GoogleSheetDB.schema` / `user_info_schema`,
+    `sheet_id` identifies a database, and rows are addressed by DataFrame index (position in the table),
+    exactly like `SheetManager`. Partitioned tables (`SheetManager.partitions`) can also be read one
+    partition at a time, e.g. fetch(sheet_id, "chats_<_fileId>"), and their rows are appended through the table.
+    """
+
+    name = None
+
+    def setup_schema(self, sheet_id):
+        raise NotImplementedError
+
+    def fetch(self, sheet_id, worksheet, incremental = False, columns = None, rows = None, cache = True):
+        """
+        :param columns: projection; :param rows: slice of DataFrame indices (the frame keeps them).
+        :param cache: False to bypass cached reads, e.g. for an index that must match the sheet.
+        """
+        raise NotImplementedError
+
+    def fetch_cells(self, sheet_id, worksheet, row_idxs, columns):
+        """:return: {row_idx: {column: value}}"""
+        raise NotImplementedError
+
+    def insert(self, sheet_id, worksheet, row: list):
+        raise NotImplementedError
+
+    def insert_rows(self, sheet_id, worksheet, rows: list[list]):
+        """Bulk insert; raises on failure (used by the write-behind queue)."""
+        raise NotImplementedError
+
+    def update(self, sheet_id, worksheet_name, row_idxs = None, column = None, values = None, cells = None):
+        raise NotImplementedError
+
+    def delete_row(self, sheet_id, worksheet_name, row_idxs: list):
+        raise NotImplementedError
+
+    def delete_partitions(self, sheet_id, table, keys):
+        """Delete whole partitions of a partitioned table, e.g. the chats of some documents; True on success."""
+        raise NotImplementedError
+
+    def acquire_lock(self, sheet_id, worksheet_name, timeout = 10):
+        raise NotImplementedError
+
+    def release_lock(self, sheet_id, worksheet_name):
+        raise NotImplementedError
+
+    def revision(self, sheet_id):
+        """Opaque marker that changes whenever the data of `sheet_id` does; None if unknown."""
+        raise NotImplementedError
+
+    def invalidate(self, sheet_id):
+        """Forget any cached reads of `sheet_id`."""
+        pass
+
+
+class GoogleSheetBackend(StorageBackend):
+    """Google Sheets as the database (the original setup)."""
+
+    name = "gsheet"
+
+    def setup_schema(self, sheet_id):
+        return GoogleSheetDB.setup_database_schema(sheet_id)
+
+    def fetch(self, sheet_id, worksheet, incremental = False, columns = None, rows = None, cache = True):
+        return SheetManager.fetch(sheet_id, worksheet, incremental = incremental, columns = columns, rows = rows, cache = cache)
+
+    def fetch_cells(self, sheet_id, worksheet, row_idxs, columns):
+        return SheetManager.fetch_cells(sheet_id, worksheet, row_idxs, columns)
+
+    def insert(self, sheet_id, worksheet, row: list):
+        return SheetManager.insert(sheet_id, worksheet, row)
+
+    def insert_rows(self, sheet_id, worksheet, rows: list[list]):
+        return SheetManager.append_rows(sheet_id, worksheet, rows)
+
+    def update(self, sheet_id, worksheet_name, row_idxs = None, column = None, values = None, cells = None):
+        return SheetManager.update(sheet_id, worksheet_name, row_idxs, column, values, cells = cells)
+
+    def delete_row(self, sheet_id, worksheet_name, row_idxs: list):
+        return SheetManager.delete_row(sheet_id, worksheet_name, row_idxs)
+
+    def delete_partitions(self, sheet_id, table, keys):
+        return SheetManager.delete_partitions(sheet_id, table, keys)
+
+    def acquire_lock(self, sheet_id, worksheet_name, timeout = 10):
+        return SheetManager.acquire_lock(sheet_id, worksheet_name, timeout)
+
+    def release_lock(self, sheet_id, worksheet_name):
+        return SheetManager.release_lock(sheet_id, worksheet_name)
+
+    def revision(self, sheet_id):
+        return SheetManager.revision(sheet_id)
+
+    def invalidate(self, sheet_id):
+        SheetManager.invalidate(sheet_id)
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Embedded SQLite engine: one database file per sheet_id under `db_dir`.
+    Table order (rowid) mirrors the row order of the worksheet, so DataFrame indices mean the same thing.
+    A partition of a table is the set of its rows with that key, read through the index on the key column.
+    """
+
+    name = "sqlite"
+
+    tables = {name: config["headers"] for name, config in {**GoogleSheetDB.schema, **GoogleSheetDB.user_info_schema}.items()}
+    indexed_columns = ["_fileId", "_tag", "_userId"]
+
+    def __init__(self, db_dir = "./.easyessay/sqlite"):
+        self.db_dir = db_dir
+        self._ready = set()
+        self._lock  = threading.Lock()
+        os.makedirs(db_dir, exist_ok = True)
+
+    def _connect(self, sheet_id):
+        conn = sqlite3.connect(os.path.join(self.db_dir, f"{sheet_id}.sqlite3"), timeout = 10)
+        with self._lock:
+            if sheet_id not in self._ready:
+                self._create_tables(conn)
+                self._ready.add(sheet_id)
+        return conn
+
+    def _create_tables(self, conn):
+        conn.execute("PRAGMA journal_mode = WAL")
+        with conn:
+            for table, headers in self.tables.items():
+                columns = ", ".join(f'"{h}" TEXT' for h in headers)
+                conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({columns})')
+                for column in self.indexed_columns:
+                    if column in headers:
+                        conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table}{column}" ON "{table}" ("{column}")')
+            conn.execute('CREATE TABLE IF NOT EXISTS "_locks" ("worksheet" TEXT PRIMARY KEY, "owner" TEXT, "expiry" REAL DEFAULT 0, "version" INTEGER DEFAULT 0)')
+            for column in ['"expiry" REAL DEFAULT 0', '"version" INTEGER DEFAULT 0']:
+                try:
+                    conn.execute(f'ALTER TABLE "_locks" ADD COLUMN {column}')     # * databases created before lease locks
+                except sqlite3.OperationalError:
+                    pass
+            conn.executemany('INSERT OR IGNORE INTO "_locks" ("worksheet", "owner") VALUES (?, ?)',
+                             [(table, LockManager.free_owner) for table in self.tables])
+            conn.execute('CREATE TABLE IF NOT EXISTS "_meta" ("key" TEXT PRIMARY KEY, "value" INTEGER)')
+            conn.execute('INSERT OR IGNORE INTO "_meta" ("key", "value") VALUES (?, 0)', ("revision",))
+
+    def _bump_revision(self, conn):
+        """Called inside the transaction of every data write."""
+        conn.execute('UPDATE "_meta" SET "value" = "value" + 1 WHERE "key" = ?', ("revision",))
+
+    def _headers(self, worksheet):
+        if worksheet not in self.tables:
+            raise ValueError(f"Unknown table: {worksheet}")
+        return self.tables[worksheet]
+
+    def _partition(self, worksheet):
+        """:return: (table, key column, key) of a partition name, or (worksheet, None, None)."""
+        table = SheetManager.table_of(worksheet)
+        if table == worksheet:
+            return worksheet, None, None
+        return table, SheetManager.partitions[table]["key"], worksheet[len(SheetManager.partitions[table]["prefix"]):]
+
+    def _rowids(self, conn, worksheet, row_idxs):
+        rowids = [r[0] for r in conn.execute(f'SELECT rowid FROM "{worksheet}" ORDER BY rowid')]
+        return [rowids[int(idx)] for idx in row_idxs if 0 <= int(idx) < len(rowids)]
+
+    def setup_schema(self, sheet_id):
+        self._connect(sheet_id).close()
+        return True
+
+    def fetch(self, sheet_id, worksheet, incremental = False, columns = None, rows = None, cache = True):
+        worksheet, key_column, key = self._partition(worksheet)
+        where, params = ("", ()) if key_column is None else (f'WHERE "{key_column}" = ?', (key,))
+        headers = self._headers(worksheet)
+        columns = headers if columns is None else list(columns)
+        if any(col not in headers for col in columns):
+            raise ValueError(f"Unknown column in: {columns}")
+        start = (rows.start or 0) if rows is not None else 0
+        limit = -1 if rows is None or rows.stop is None else max(rows.stop - start, 0)
+        select = ", ".join(f'"{col}"' for col in columns)
+        conn = self._connect(sheet_id)
+        try:
+            data = conn.execute(f'SELECT {select} FROM "{worksheet}" {where} ORDER BY rowid LIMIT ? OFFSET ?', (*params, limit, start)).fetchall()
+        finally:
+            conn.close()
+        return pd.DataFrame(data, columns = columns, index = range(start, start + len(data)))
+
+    def fetch_cells(self, sheet_id, worksheet, row_idxs, columns):
+        headers = self._headers(worksheet)
+        select = ", ".join(f'"{col}"' for col in columns if col in headers)
+        conn = self._connect(sheet_id)
+        try:
+            rowids = [r[0] for r in conn.execute(f'SELECT rowid FROM "{worksheet}" ORDER BY rowid')]
+            result = {}
+            for idx in row_idxs:
+                if 0 <= int(idx) < len(rowids):
+                    values = conn.execute(f'SELECT {select} FROM "{worksheet}" WHERE rowid = ?', (rowids[int(idx)],)).fetchone()
+                    result[idx] = dict(zip(columns, values))
+            return result
+        finally:
+            conn.close()
+
+    def insert(self, sheet_id, worksheet, row: list):
+        self.insert_rows(sheet_id, worksheet, [row])
+
+    def insert_rows(self, sheet_id, worksheet, rows: list[list]):
+        conn = self._connect(sheet_id)
+        try:
+            with conn:
+                self._insert_rows(conn, worksheet, rows)
+        finally:
+            conn.close()
+
+    def update(self, sheet_id, worksheet_name, row_idxs = None, column = None, values = None, cells = None):
+        if cells is None:
+            cells = [(idx, column, value) for idx, value in zip(row_idxs, values)]
+        conn = self._connect(sheet_id)
+        try:
+            with conn:
+                return self._update(conn, worksheet_name, cells)
+        finally:
+            conn.close()
+
+    def delete_row(self, sheet_id, worksheet_name, row_idxs: list):
+        conn = self._connect(sheet_id)
+        try:
+            with conn:
+                self._delete_rows(conn, worksheet_name, row_idxs)
+            return True
+        finally:
+            conn.close()
+
+    def delete_partitions(self, sheet_id, table, keys):
+        conn = self._connect(sheet_id)
+        try:
+            with conn:
+                self._delete_partitions(conn, table, keys)
+            return True
+        finally:
+            conn.close()
+
+    # * Write helpers take an open connection, so that callers can add statements to the same transaction
+
+    def _insert_rows(self, conn, worksheet, rows):
+        worksheet = SheetManager.table_of(worksheet)      # * rows of a partition carry its key
+        headers = self._headers(worksheet)
+        placeholders = ", ".join("?" for _ in headers)
+        conn.executemany(f'INSERT INTO "{worksheet}" VALUES ({placeholders})',
+                         [[str(v) for v in (list(row) + [""] * len(headers))[:len(headers)]] for row in rows])
+        self._bump_revision(conn)
+
+    def _update(self, conn, worksheet_name, cells):
+        headers = self._headers(worksheet_name)
+        rowids = [r[0] for r in conn.execute(f'SELECT rowid FROM "{worksheet_name}" ORDER BY rowid')]
+        results = []
+        for idx, col, value in cells:
+            if col not in headers:
+                raise ValueError(f"Unknown column: {col}")
+            if 0 <= int(idx) < len(rowids):
+                conn.execute(f'UPDATE "{worksheet_name}" SET "{col}" = ? WHERE rowid = ?', (str(value), rowids[int(idx)]))
+                a1 = gspread.utils.rowcol_to_a1(int(idx) + 2, headers.index(col) + 1)
+                results.append({"updatedRange": f"{worksheet_name}!{a1}", "updatedCells": 1})
+        self._bump_revision(conn)
+        return results
+
+    def _delete_rows(self, conn, worksheet_name, row_idxs):
+        self._headers(worksheet_name)
+        conn.executemany(f'DELETE FROM "{worksheet_name}" WHERE rowid = ?',
+                         [(rowid,) for rowid in self._rowids(conn, worksheet_name, row_idxs)])
+        self._bump_revision(conn)
+
+    def _delete_partitions(self, conn, table, keys):
+        key_column = SheetManager.partitions[table]["key"]
+        conn.executemany(f'DELETE FROM "{table}" WHERE "{key_column}" = ?', [(str(key),) for key in keys])
+        self._bump_revision(conn)
+
+    def acquire_lock(self, sheet_id, worksheet_name, timeout = 10):
+        """Lease lock with a real compare-and-set on the version column (see LockManager)."""
+        me = LockManager.owner()
+        start_time = time.time()
+        attempt = 0
+        conn = self._connect(sheet_id)
+        try:
+            while True:
+                attempt += 1
+                with conn:
+                    owner, expiry, version = conn.execute('SELECT "owner", "expiry", "version" FROM "_locks" WHERE "worksheet" = ?',
+                                                          (worksheet_name,)).fetchone()
+                    if LockManager.is_available(owner, expiry or 0, me):
+                        cursor = conn.execute('UPDATE "_locks" SET "owner" = ?, "expiry" = ?, "version" = ? WHERE "worksheet" = ? AND "version" = ?',
+                                              (me, time.time() + LockManager.lease_ttl, (version or 0) + 1, worksheet_name, version or 0))
+                        if cursor.rowcount == 1:
+                            LockManager.record(worksheet_name, True, time.time() - start_time, attempt)
+                            return True
+
+                remaining = timeout - (time.time() - start_time)
+                if remaining <= 0:
+                    break
+                time.sleep(min(LockManager.backoff(attempt), remaining))
+
+            LockManager.record(worksheet_name, False, time.time() - start_time, attempt)
+            return False
+        finally:
+            conn.close()
+
+    def release_lock(self, sheet_id, worksheet_name):
+        conn = self._connect(sheet_id)
+        try:
+            with conn:
+                cursor = conn.execute('UPDATE "_locks" SET "owner" = ?, "expiry" = 0, "version" = "version" + 1 WHERE "worksheet" = ? AND "owner" = ?',
+                                      (LockManager.free_owner, worksheet_name, LockManager.owner()))
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def revision(self, sheet_id):
+        conn = self._connect(sheet_id)
+        try:
+            return str(conn.execute('SELECT "value" FROM "_meta" WHERE "key" = ?', ("revision",)).fetchone()[0])
+        finally:
+            conn.close()
+
+
+class StorageManager:
+    """
+    Picks the storage backend from st.secrets:
+
+        [storage]
+        backend = "gsheet"      # or "sqlite", or "replica" (local SQLite copy synced with Google Sheets)
+        sqlite_dir = "./.easyessay/sqlite"
+        replica_dir = "./.easyessay/replica"
+    """
+
+    backends = {
+        "gsheet": GoogleSheetBackend,
+        "sqlite": SQLiteBackend
+    }
+    _backend = None
+    _lock    = threading.Lock()
+
+    @staticmethod
+    def backend() -> StorageBackend:
+        with StorageManager._lock:
+            if StorageManager._backend is None:
+                config = st.secrets.get("storage", {})
+                name = config.get("backend", "gsheet")
+                if name == "sqlite":
+                    StorageManager._backend = SQLiteBackend(config.get("sqlite_dir", "./.easyessay/sqlite"))
+                elif name == "replica":
+                    from utils.replica_manager import ReplicaBackend      # * imports this module
+                    StorageManager._backend = ReplicaBackend(config.get("replica_dir", "./.easyessay/replica"))
+                else:
+                    StorageManager._backend = StorageManager.backends[name]()
+            return StorageManager._backend
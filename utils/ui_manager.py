@@ -32,13 +32,9 @@ class UIManager:
 
 
 
-            Others.fetch_IP()   
-
-            backend_health_check = requests.get("https://easyessaybackend.onrender.com/")
-            if backend_health_check.status_code != 200:
-                st.warning("Backend server collapsed! Please try again later.")
-            else:
-                st.caption("Backend server is healthy.")
+            # * last known status; the probes run in the background (see Others.probe)
+            Others.fetch_IP()
+            Others.show_backend_health()
             
 
     @staticmethod
@@ -2,9 +2,136 @@ import streamlit as st
 import hashlib
 import datetime as dt
 import time
+import threading
 import requests
 from utils.data_manager import DataManager
-from utils.sheet_manager import SheetManager, GoogleSheetDB
+from utils.sheet_manager import SheetManager
+from utils.storage_manager import StorageManager
+from utils.index_manager import IndexManager
+from utils.session_manager import SessionManager
+
+
+class UserDirectory:
+    """
+    Process-wide index of the central `user_info` table.
+
+    Records are kept in table order with hash indexes by `_userId`, `_email` and `_dbURL`, so a login
+    is one dict lookup instead of several column scans. A refresh first compares the revision of the
+    sheet, and when it changed reads only the rows appended since the last read (tail fetch), which
+    also notices deleted rows. Rows edited in place (e.g. a new `_dbURL`) are not in the tail: writes
+    from this process call `invalidate`, and the whole table is re-read every `full_refresh_interval`
+    for writes from other processes.
+    """
+
+    indexed_columns = ["_userId", "_email", "_dbURL"]
+    refresh_interval = 30         # seconds; how stale a lookup may be before the table is re-read
+    full_refresh_interval = 600   # seconds; how stale a row edited by another process may be
+
+    _records      = []            # one dict per row of user_info, in table order
+    _indexes      = {column: {} for column in indexed_columns}
+    _revision     = None          # revision of user_info at the last read
+    _refreshed_at = 0.0
+    _full_at      = 0.0           # time of the last full read
+    _tickets      = 0             # refreshes started (and invalidations), in order
+    _loaded       = 0             # ticket of the refresh whose frame is indexed
+    _invalidated  = 0             # ticket of the last invalidation
+    _lock         = threading.RLock()
+
+    @staticmethod
+    def sheet_id():
+        return SheetManager.extract_sheet_id(st.secrets['gsheet-urls']['user'])
+
+    @staticmethod
+    def load(frame, reindex = False):
+        """
+        Bring the indexes in line with a fresh `user_info` frame. Rows already indexed are skipped
+        when the frame extends them (same length or longer, same last indexed row); otherwise, or
+        with `reindex`, everything is re-indexed.
+        :return: number of rows indexed.
+        """
+        with UserDirectory._lock:
+            records = UserDirectory._records
+            n = len(records)
+            extends = (not reindex and len(frame) >= n and
+                       (n == 0 or all(frame[column].iat[n - 1] == records[n - 1][column]
+                                      for column in UserDirectory.indexed_columns)))
+            if not extends:
+                records = []
+                UserDirectory._indexes = {column: {} for column in UserDirectory.indexed_columns}
+                n = 0
+
+            new_records = frame.iloc[n:].to_dict("records")
+            records.extend(new_records)
+            for column, index in UserDirectory._indexes.items():
+                index.update((record[column], record) for record in new_records if record.get(column))
+
+            UserDirectory._records = records
+            UserDirectory._refreshed_at = time.time()
+            return len(records) - n
+
+    @staticmethod
+    def refresh(force = False):
+        """
+        Re-read user_info if the indexes are older than `refresh_interval` (or always, with force) and
+        the table changed since the last read. The network calls are made without holding `_lock`.
+        """
+        with UserDirectory._lock:
+            now = time.time()
+            if not force and now - UserDirectory._refreshed_at < UserDirectory.refresh_interval:
+                return
+            UserDirectory._tickets += 1
+            ticket = UserDirectory._tickets
+            full = (UserDirectory._invalidated >= UserDirectory._loaded or
+                    now - UserDirectory._full_at >= UserDirectory.full_refresh_interval)
+            known = UserDirectory._revision
+
+        backend = StorageManager.backend()
+        revision = backend.revision(UserDirectory.sheet_id())
+        if not full and revision is not None and revision == known:
+            with UserDirectory._lock:
+                UserDirectory._refreshed_at = time.time()
+            return
+        frame = backend.fetch(UserDirectory.sheet_id(), "user_info", incremental = True, cache = not full)
+        if "_userId" not in frame.columns:
+            return
+
+        with UserDirectory._lock:
+            if ticket < UserDirectory._loaded:
+                return        # * a refresh started later has already indexed a newer frame
+            UserDirectory.load(frame, reindex = full)
+            UserDirectory._loaded = ticket
+            UserDirectory._revision = revision
+            if full:
+                UserDirectory._full_at = now
+
+    @staticmethod
+    def invalidate():
+        """Re-read the whole of user_info on the next lookup, e.g. after this process edited it."""
+        with UserDirectory._lock:
+            UserDirectory._tickets += 1
+            UserDirectory._invalidated = UserDirectory._tickets
+            UserDirectory._refreshed_at = 0.0
+            UserDirectory._revision = None
+
+    @staticmethod
+    def lookup(column, value):
+        """:return: the user record whose `column` equals `value`, or None."""
+        with UserDirectory._lock:
+            return UserDirectory._indexes[column].get(value)
+
+    @staticmethod
+    def find(user_id_or_email):
+        """
+        Look up a user by User ID or email; a miss re-reads the table once, since the user may
+        have registered through another process.
+        """
+        UserDirectory.refresh()
+        for attempt in range(2):
+            record = UserDirectory.lookup("_userId", user_id_or_email) or UserDirectory.lookup("_email", user_id_or_email)
+            if record is not None or attempt:
+                return record
+            UserDirectory.refresh(force = True)
+
 
 class UserManager:
     # * Hash password
@@ -30,43 +157,24 @@ class UserManager:
             with st.spinner("Verifying..."):
 
                 # 驗證登入
-                st.session_state['user_infos'] = SheetManager.fetch(SheetManager.extract_sheet_id(st.secrets['gsheet-urls']['user']), "user_info")
-                if ((user_id not in st.session_state['user_infos']['_userId'].tolist()) and
-                    (user_id not in st.session_state['user_infos']['_email'].tolist())):
-
+                record = UserDirectory.find(user_id)
+                if record is None:
                     st.warning("User ID / Email Not Found!")
                     st.stop()
-                if user_id.endswith("@gmail.com"): 
-                    ps_hash_cached = st.session_state['user_infos'].loc[st.session_state['user_infos']['_email'] == user_id, "_password"].tolist()[0]
-                else:
-                    ps_hash_cached = st.session_state['user_infos'].loc[st.session_state['user_infos']['_userId'] == user_id, "_password"].tolist()[0]
                 
-                if not UserManager.ps_verify(password, ps_hash_cached):
+                if not UserManager.ps_verify(password, record["_password"]):
                     st.warning("Wrong password! Try again!")
                     st.stop()
 
                 # 成功登入
                 st.session_state['logged_in'] = True
-                
+                st.session_state['user_name'] = record["_username"]
+                st.session_state['user_id'] = record["_userId"]
+                st.session_state['_dbURL'] = record["_dbURL"]
+                st.session_state['user_email'] = record["_email"]
+                st.session_state['_registerTime'] = record["_registerTime"]
 
-                try:
-                    st.session_state['user_name'] = st.session_state['user_infos'].loc[st.session_state['user_infos']['_userId'] == user_id, "_username"].tolist()[0]
-                    st.session_state['user_id'] = st.session_state['user_infos'].loc[st.session_state['user_infos']['_userId'] == user_id, "_userId"].tolist()[0]
-                    st.session_state['_dbURL'] = st.session_state['user_infos'].loc[st.session_state['user_infos']['_userId'] == user_id, "_dbURL"].tolist()[0]
-                
-
-                except:
-                    st.session_state['user_name'] = st.session_state['user_infos'].loc[st.session_state['user_infos']['_email'] == user_id, "_username"].tolist()[0]
-                    st.session_state['user_id'] = st.session_state['user_infos'].loc[st.session_state['user_infos']['_email'] == user_id, "_userId"].tolist()[0]
-                    st.session_state['_dbURL'] = st.session_state['user_infos'].loc[st.session_state['user_infos']['_email'] == user_id, "_dbURL"].tolist()[0]
-                    
-
-
-                st.session_state['user_email'] = st.session_state['user_infos'].loc[st.session_state['user_infos']['_userId'] == st.session_state["user_id"], "_email"].tolist()[0]
-                st.session_state['_registerTime'] = st.session_state['user_infos'].loc[st.session_state['user_infos']['_userId'] == st.session_state["user_id"], "_registerTime"].tolist()[0]
-
-                del ps_hash_cached
-                del st.session_state["user_infos"]
+                del record
                 st.rerun()
 
     @staticmethod
@@ -79,7 +187,7 @@ class UserManager:
         password_confirm = st.text_input("Password Confirmation", type = "password")
         database_url = st.text_input("Please input a :blue[PUBLICLY EDITABLE] google sheet url as your database.", help = "Create a new empty google sheet, set the link **public** and **editable**, and paste it here. This link is used to store your literature summaries and chat histories.")
         if st.button("Submit", key = "Regist"):
-            st.session_state['user_infos'] = SheetManager.fetch(SheetManager.extract_sheet_id(st.secrets['gsheet-urls']['user']), "user_info")
+            UserDirectory.refresh(force = True)
             # * 註冊驗證
             if not username:
                 st.warning("Please input User Nickname")
@@ -87,7 +195,7 @@ class UserManager:
             if not user_id:
                 st.warning("Please input User ID")
                 st.stop()
-            if user_id in st.session_state['user_infos']['_userId'].tolist():
+            if UserDirectory.lookup("_userId", user_id) is not None:
                 st.warning("The User ID has been taken. Please try another one.")
                 st.stop()
             if not email:
@@ -96,7 +204,7 @@ class UserManager:
             if not email.endswith("@gmail.com"):
                 st.warning("Please input valid gmail address.")
                 st.stop()
-            if email in st.session_state['user_infos']['_email'].tolist():
+            if UserDirectory.lookup("_email", email) is not None:
                 st.warning("The gmail has been used to register. Please log in or try a different one.")
                 st.stop()
             if not password_:
@@ -105,27 +213,30 @@ class UserManager:
             if password_ != password_confirm:
                 st.warning("Password confirmation did not match. Try again.")
                 st.stop()
-            if database_url in st.session_state['user_infos']['_dbURL'].tolist():
+            if UserDirectory.lookup("_dbURL", database_url) is not None:
                 st.warning("URL for data storage used. Open a new empty google sheet, set the link open and editable, and paste it here.")
                 st.stop()
+            if SheetManager.extract_sheet_id(database_url) is None:
+                st.stop()
 
             # * Submit registration
             with st.spinner("Registering..."):
                 st.session_state['_dbURL'] = database_url
                 st.session_state['sheet_id'] = SheetManager.extract_sheet_id(database_url)
-                GoogleSheetDB.setup_database_schema(st.session_state['sheet_id'])
-                st.session_state["user_tags"] = SheetManager.fetch(st.session_state["sheet_id"], "user_tags") 
+                StorageManager.backend().setup_schema(st.session_state['sheet_id'])
+                st.session_state["user_tags"] = StorageManager.backend().fetch(st.session_state["sheet_id"], "user_tags") 
 
                 now = dt.datetime.now().strftime("%I:%M%p on %B %d, %Y")
-                SheetManager.insert(
-                    sheet_id = SheetManager.extract_sheet_id(st.secrets['gsheet-urls']['user']),
+                StorageManager.backend().insert(
+                    sheet_id = UserDirectory.sheet_id(),
                     worksheet = "user_info",
                     row = [username, user_id, email, UserManager.ps_hash(password_), now, database_url]
                 )
+                UserDirectory.invalidate()
                 while True:
                     default_tag_id = DataManager.generate_random_index()
                     if default_tag_id not in st.session_state['user_tags']['_tag'].tolist():
-                        SheetManager.insert(
+                        StorageManager.backend().insert(
                             sheet_id = st.session_state['sheet_id'],
                             worksheet = "user_tags",
                             row = [default_tag_id, "default"]
@@ -139,8 +250,7 @@ class UserManager:
             st.session_state['user_email'] = email
             st.session_state['_registerTime'] = now
             st.session_state["_dbURL"] = database_url
-            del st.session_state['user_tags']
-            del st.session_state["user_infos"]
+            SessionManager.invalidate("user_tags")
             st.rerun()
 
     @staticmethod
@@ -158,14 +268,14 @@ class UserManager:
             # *** Start deleting user informations
             # * deleting user info
             with st.spinner("Deleting user data..."):
-                SheetManager.acquire_lock(SheetManager.extract_sheet_id(st.secrets["gsheet-urls"]["user"]),
-                                        "user_info")
-                st.session_state['user_info'] = SheetManager.fetch(
-                    SheetManager.extract_sheet_id(st.secrets["gsheet-urls"]["user"]), "user_info")
-                user_idx = st.session_state['user_info'][st.session_state['user_info']['_userId'] == st.session_state['user_id']].index.tolist()
-                SheetManager.delete_row(
-                    SheetManager.extract_sheet_id(st.secrets["gsheet-urls"]["user"]), "user_info", user_idx)
-                SheetManager.release_lock(
+                if StorageManager.backend().acquire_lock(SheetManager.extract_sheet_id(st.secrets["gsheet-urls"]["user"]),
+                                        "user_info") == False:
+                    st.warning("The server is busy. Please try again later.")
+                    st.stop()
+                # * the row is located by _userId at write time, checked against the sheet
+                IndexManager.delete_by_key(UserDirectory.sheet_id(), "user_info", "_userId", [st.session_state['user_id']])
+                UserDirectory.invalidate()
+                StorageManager.backend().release_lock(
                     SheetManager.extract_sheet_id(st.secrets["gsheet-urls"]["user"]), "user_info")
             
             # * ! Documents, Tags and Chat histories are stored in Self-management database. So the deletion of the account does not delete these data in decentralized settings!!